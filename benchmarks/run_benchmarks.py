@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Benchmarks des chemins critiques de la bibliothèque.
+
+Un serveur HTTP local rejoue les réponses de samples/data (via ReplayTransport)
+à la place du site du Crédit Agricole. Pour chaque scénario, le script mesure
+les percentiles de latence, le nombre de requêtes reçues par le serveur et le
+pic mémoire côté client.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from creditagricole_particuliers import Authenticator, Accounts, Cards
+from creditagricole_particuliers.transport import HttpTransport, ReplayTransport
+
+SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "..", "samples", "data")
+BANK_URL = "https://www.credit-agricole.fr"
+
+
+class ReplayServer:
+    def __init__(self, replay):
+        """local http server answering from a replay transport"""
+        self.replay = replay
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+            wbufsize = -1
+
+            def answer(self):
+                length = int(self.headers.get("Content-Length", 0))
+                data = self.rfile.read(length).decode() if length else None
+                server.requests += 1
+                status_code, body = server.replay.route(self.command, self.path, data)
+                body = (body if isinstance(body, str) else json.dumps(body)).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = answer
+            do_POST = answer
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%s" % self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """stop the server"""
+        self.httpd.shutdown()
+
+
+class LocalTransport(HttpTransport):
+    def __init__(self, url, **kwargs):
+        """http transport redirecting the bank website to the local server"""
+        super().__init__(**kwargs)
+        self.local_url = url
+
+    def request(self, method, url, **kwargs):
+        """send the request to the local server"""
+        return super().request(method, url.replace(BANK_URL, self.local_url), **kwargs)
+
+
+def percentile(values, p):
+    """percentile of sorted values"""
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def measure(name, server, func, repeat):
+    """run func repeat times, return latency percentiles, requests and peak memory"""
+    timings = []
+    requests_before = server.requests
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    requests = server.requests - requests_before
+
+    # one more run for the memory, tracing slows down the timings
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {"name": name,
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p90_ms": round(percentile(timings, 90), 3),
+            "p99_ms": round(percentile(timings, 99), 3),
+            "requests": requests // repeat,
+            "peak_kb": round(peak / 1024, 1)}
+
+
+def login(server):
+    """session against the local server, without response cache"""
+    return Authenticator(username="12345678901", password=[1, 2, 3, 4, 5, 6], department=57,
+                         cache=False, transport=LocalTransport(server.url))
+
+
+def run(path, repeat, sizes):
+    """run every benchmark"""
+    results = []
+
+    server = ReplayServer(ReplayTransport(path=path))
+    session = login(server)
+    results.append(measure("authenticate", server, session.authenticate, repeat))
+    results.append(measure("accounts", server, lambda: Accounts(session), repeat))
+
+    def cards_operations():
+        session.invalidate_accounts()
+        for card in Cards(session):
+            card.get_operations()
+    results.append(measure("cards+operations", server, cards_operations, repeat))
+
+    accounts = Accounts(session)
+    cards = Cards(session)
+    results.append(measure("accounts.as_json", server, accounts.as_json, repeat))
+    results.append(measure("cards.as_json", server, cards.as_json, repeat))
+    session.close()
+    server.stop()
+
+    for size in sizes:
+        server = ReplayServer(ReplayTransport(path=path, operations=size))
+        session = login(server)
+        account = Accounts(session).search("12345678901")
+
+        def operations():
+            return account.get_operations(date_start="2000-01-01", date_stop="2030-01-01", count=size)
+        results.append(measure("operations[%s]" % size, server, operations, repeat))
+
+        def operations_auto():
+            return account.get_operations(date_start="2000-01-01", date_stop="2030-01-01", count=size, limit="auto")
+        results.append(measure("operations[%s] limit=auto" % size, server, operations_auto, repeat))
+
+        ops = operations()
+        results.append(measure("operations[%s].as_json" % size, server, ops.as_json, repeat))
+        session.close()
+        server.stop()
+
+    return results
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Benchmark the library against a local replay server')
+    parser.add_argument('--samples', default=SAMPLES_PATH, help='Directory of the replayed responses')
+    parser.add_argument('--repeat', type=int, default=10, help='Runs per benchmark')
+    parser.add_argument('--sizes', default="100,1000,10000", help='Operations history sizes')
+    parser.add_argument('--output', default=None, help='Save the results to a JSON file')
+    args = parser.parse_args()
+
+    results = run(args.samples, args.repeat, [int(s) for s in args.sizes.split(",")])
+
+    print("%-28s %10s %10s %10s %9s %10s" % ("benchmark", "p50 ms", "p90 ms", "p99 ms", "requests", "peak KB"))
+    for r in results:
+        print("%-28s %10s %10s %10s %9s %10s" % (r["name"], r["p50_ms"], r["p90_ms"], r["p99_ms"],
+                                                 r["requests"], r["peak_kb"]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
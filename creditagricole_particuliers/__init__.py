@@ -2,3 +2,12 @@ from creditagricole_particuliers.accounts import Accounts
 from creditagricole_particuliers.authenticator import Authenticator
 from creditagricole_particuliers.logout import Logout
 from creditagricole_particuliers.cards import Cards
+from creditagricole_particuliers.aio import AsyncAuthenticator, AsyncAccounts, AsyncOperations, AsyncCards, AsyncLogout
+from creditagricole_particuliers.cache import MemoryCache, DiskCache
+from creditagricole_particuliers.sync import IncrementalSync
+from creditagricole_particuliers.pool import SessionPool
+from creditagricole_particuliers.ratelimit import RateLimiter
+from creditagricole_particuliers.analytics import AccountsFrame, OperationsFrame
+from creditagricole_particuliers.store import OperationsStore
+from creditagricole_particuliers.metrics import Metrics
+from creditagricole_particuliers.profiling import Profiler
@@ -1,8 +1,12 @@
 
-import requests
+import io
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from creditagricole_particuliers import export
 from creditagricole_particuliers import operations
 from creditagricole_particuliers import iban
 
@@ -12,6 +16,23 @@ FAMILLE_PRODUITS = [
      {"code": 7, "familleProduit": "EPARGNE_AUTRE"},
 ]
 
+def default_date_range(date_start, date_stop):
+    """last 30 days when no date range is provided"""
+    if date_stop is None:
+        current_date = datetime.today()
+        previous_date = current_date - timedelta(days=30)
+        date_stop = current_date.strftime('%Y-%m-%d')
+        date_start = previous_date.strftime('%Y-%m-%d')
+    return date_start, date_stop
+
+def find_account(session, num):
+    """search account in the session index, accounts are fetched once when the index is empty"""
+    if not session.accounts_index:
+        Accounts(session=session)
+    if num not in session.accounts_index:
+        raise Exception( "[error] account not found" )
+    return session.accounts_index[num]
+
 class Account:
     def __init__(self, session, account):
         """account class"""
@@ -25,26 +46,38 @@ class Account:
         """str"""
         return f"Compte[numero={self.numeroCompte}, produit={self.account['libelleProduit']}]"
  
-    def get_iban(self):
+    def get_iban(self, lazy=False):
         """get iban"""
         return iban.Iban(session=self.session, 
                          compteIdx=self.compteIdx,
                          grandeFamilleCode=self.grandeFamilleCode,
-                         numeroCompte=self.numeroCompte)
+                         numeroCompte=self.numeroCompte,
+                         lazy=lazy)
 
-    def get_operations(self, date_start=None, date_stop=None, count=100, sleep=None):
+    def get_operations(self, date_start=None, date_stop=None, count=100, sleep=None, lazy=False, compact=False,
+                       shard_days=None, max_workers=4, limit=operations.DEFAULT_LIMIT, exact=False):
         """get operations"""
-        if date_stop is None:
-            current_date = datetime.today()
-            previous_date = current_date - timedelta(days=30)
-            date_stop = current_date.strftime('%Y-%m-%d')
-            date_start = previous_date.strftime('%Y-%m-%d')
-            
+        date_start, date_stop = default_date_range(date_start, date_stop)
         return operations.Operations(session=self.session, 
                                      compteIdx=self.compteIdx,
                                      grandeFamilleCode=self.grandeFamilleCode,
                                      date_start=date_start,
-                                     date_stop=date_stop, count=count, sleep=sleep)
+                                     date_stop=date_stop, count=count, sleep=sleep,
+                                     lazy=lazy, compact=compact,
+                                     shard_days=shard_days, max_workers=max_workers,
+                                     limit=limit, exact=exact)
+
+    def iter_operations(self, date_start=None, date_stop=None, count=100, sleep=None, compact=False,
+                        limit=operations.DEFAULT_LIMIT, exact=False):
+        """iterate over operations, pages are fetched on demand"""
+        date_start, date_stop = default_date_range(date_start, date_stop)
+        return iter(operations.Operations(session=self.session,
+                                          compteIdx=self.compteIdx,
+                                          grandeFamilleCode=self.grandeFamilleCode,
+                                          date_start=date_start,
+                                          date_stop=date_stop, count=count, sleep=sleep,
+                                          stream=True, compact=compact,
+                                          limit=limit, exact=exact))
 
     def as_json(self):
         """return as json"""
@@ -57,15 +90,27 @@ class Account:
         return self.account["solde"]
 
 class Accounts:
-    def __init__(self, session):
-        """operations class"""
+    def __init__(self, session, max_workers=None, lazy=False):
+        """accounts class, set max_workers to fetch the product families concurrently,
+        with lazy=True the accounts are fetched on first access"""
         self.session = session
+        self.max_workers = max_workers
         self.accounts_list = []
+        self.loaded = False
         
-        self.get_accounts_per_products()
+        if not lazy:
+            self.load()
+
+    def load(self):
+        """fetch the accounts on first access"""
+        if not self.loaded:
+            self.get_accounts_per_products()
+            self.loaded = True
+        return self
 
     def __iter__(self):
         """iter"""
+        self.load()
         self.n = 0
         return self
         
@@ -80,6 +125,7 @@ class Accounts:
 
     def search(self, num):
         """search account according to the num"""
+        self.load()
         for acc in self.accounts_list:
             if acc.numeroCompte == num:
                 return acc
@@ -87,29 +133,109 @@ class Accounts:
 
     def as_json(self):
         """as json"""
-        _accs = []
-        for acc in self.accounts_list:
-            _accs.append(acc.account)
-        return json.dumps(_accs)
+        self.load()
+        fp = io.StringIO()
+        export.write_json(self.accounts_list, fp, backend="json")
+        return fp.getvalue()
+
+    def export(self, fp, fmt="ndjson", **kwargs):
+        """write the accounts to a file-like object, see export.write"""
+        return export.write(self.load().accounts_list, fp, fmt, **kwargs)
+
+    def build_url(self, code):
+        """build url of the accounts for a product family"""
+        url = "%s" % self.session.url
+        url += "/%s/particulier/operations/" % self.session.regional_bank_url
+        url += "synthese/jcr:content.produits-valorisation.json/%s" % code
+        return url
+
+    def get_accounts_per_family(self, code):
+        """get accounts descriptions of one product family"""
+        r = self.session.get(url=self.build_url(code), endpoint="produits-valorisation")
+        if r.status_code != 200:
+            raise Exception( "[error] get accounts: %s - %s" % (r.status_code, r.text) )
+        return json.loads(r.text)
 
     def get_accounts_per_products(self):
         """get accounts per products"""
-        for f in FAMILLE_PRODUITS:
-            # call operations ressources
-            url = "%s" % self.session.url
-            url += "/%s/particulier/operations/" % self.session.regional_bank_url
-            url += "synthese/jcr:content.produits-valorisation.json/%s" % f["code"]
-            r = requests.get(url=url,
-                            verify=self.session.ssl_verify,
-                            cookies=self.session.cookies)
-            if r.status_code != 200:
-                raise Exception( "[error] get accounts: %s - %s" % (r.status_code, r.text) )
-
-            for descr in json.loads(r.text):
+        codes = [f["code"] for f in FAMILLE_PRODUITS]
+        if self.max_workers:
+            # families are independent, results keep the FAMILLE_PRODUITS order
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                families = list(executor.map(self.get_accounts_per_family, codes))
+        else:
+            families = [self.get_accounts_per_family(code) for code in codes]
+
+        for descrs in families:
+            for descr in descrs:
                 self.accounts_list.append( Account(self.session, descr) )
+        self.update_index()
+
+    def update_index(self):
+        """share the accounts with the session, keyed by numeroCompte"""
+        self.session.accounts_index = {acc.numeroCompte: acc for acc in self.accounts_list}
+
+    def get_all_operations(self, date_start=None, date_stop=None, max_workers=4, count=None, sleep=None, compact=False,
+                           limit=operations.DEFAULT_LIMIT):
+        """operations of every account, fetched concurrently, yields (numeroCompte, operation)
+
+        the pages of one account are fetched in sequence, operations of an account keep their order
+        """
+        self.load()
+        date_start, date_stop = default_date_range(date_start, date_stop)
+        pages = queue.Queue(maxsize=max_workers * 2)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def fetch(acc):
+            if stop.is_set():
+                return
+            try:
+                ops = operations.Operations(session=self.session,
+                                            compteIdx=acc.compteIdx,
+                                            grandeFamilleCode=acc.grandeFamilleCode,
+                                            date_start=date_start,
+                                            date_stop=date_stop, count=count, sleep=sleep,
+                                            stream=True, compact=compact, limit=limit)
+                for page in ops.iter_pages(count=count, sleep=sleep):
+                    if stop.is_set():
+                        return
+                    put((acc.numeroCompte, page))
+            except Exception as e:
+                put((acc.numeroCompte, e))
+            finally:
+                put((acc.numeroCompte, None))
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for acc in self.accounts_list:
+                executor.submit(fetch, acc)
+
+            remaining = len(self.accounts_list)
+            while remaining:
+                numeroCompte, page = pages.get()
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for op in page:
+                        yield numeroCompte, op
+        finally:
+            # the accounts not started yet are dropped, the running ones stop after their current page
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
 
     def get_solde(self):
         """get global solde"""
+        self.load()
         solde = 0
         for acc in self.accounts_list:
             solde += acc.get_solde()
@@ -117,14 +243,13 @@ class Accounts:
 
     def get_solde_per_products(self):
         """get solde per products"""
-        ret_soldes = {}
-        for f in FAMILLE_PRODUITS:
-            ret_soldes[f["familleProduit"]] = 0.0
+        self.load()
+        soldes = {}
+        for acc in self.accounts_list:
+            code = int(acc.grandeFamilleCode)
+            soldes[code] = soldes.get(code, 0.0) + acc.get_solde()
 
+        ret_soldes = {}
         for f in FAMILLE_PRODUITS:
-            for acc in self.accounts_list:
-                if int(acc.grandeFamilleCode) == f["code"]:
-                    ret_soldes[f["familleProduit"]] += acc.get_solde()
-            ret_soldes[f["familleProduit"]] = round(ret_soldes[f["familleProduit"]], 2)
-
+            ret_soldes[f["familleProduit"]] = round(soldes.get(f["code"], 0.0), 2)
         return ret_soldes
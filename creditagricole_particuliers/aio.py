@@ -0,0 +1,371 @@
+import asyncio
+import json
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from creditagricole_particuliers import authenticator
+from creditagricole_particuliers import accounts
+from creditagricole_particuliers import operations
+from creditagricole_particuliers import cards
+from creditagricole_particuliers import iban
+from creditagricole_particuliers import logout
+from creditagricole_particuliers import metrics as request_metrics
+
+
+def sync_only(name):
+    """method of the synchronous client, blocked on the async client where it would not await its requests"""
+    def blocked(self, *args, **kwargs):
+        raise Exception("[error] %s is not available on the async client" % name)
+    blocked.__name__ = name
+    return blocked
+
+
+class AsyncResponse:
+    def __init__(self, status_code, text):
+        """response read from the async client"""
+        self.status_code = status_code
+        self.text = text
+
+
+class AsyncAuthenticator(authenticator.Authenticator):
+    def __init__(self, username, password, department, pool_size=10, timeout=30,
+                 cache=None, cache_ttl=None, metrics=None):
+        """async authenticator class, use `session = await AsyncAuthenticator(...)`"""
+        if aiohttp is None:
+            raise Exception("[error] aiohttp is required for the async client: pip install aiohttp")
+
+        # the requests go through the aiohttp pool opened by start, not through a transport
+        self.setup(username, password, department, timeout=timeout, cache=cache, cache_ttl=cache_ttl,
+                   metrics=metrics)
+        self.pool_size = pool_size
+        self.http = None
+
+    def __await__(self):
+        """authenticate on await"""
+        return self.start().__await__()
+
+    async def __aenter__(self):
+        """async context manager"""
+        return await self
+
+    async def __aexit__(self, *exc):
+        """close the connection pool"""
+        await self.close()
+
+    async def start(self):
+        """open the connection pool and authenticate"""
+        if self.http is None:
+            self.http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size,
+                                                                             ssl=self.ssl_verify),
+                                              timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                              cookie_jar=aiohttp.CookieJar(unsafe=True))
+            self.cookies = self.http.cookie_jar
+            self.find_regional_bank()
+            await self.authenticate()
+        return self
+
+    # requests of the synchronous client, and session files holding a requests cookie jar
+    send = sync_only("send")
+    export_session = sync_only("export_session")
+    import_session = sync_only("import_session")
+    restore_session = sync_only("restore_session")
+
+    def find_regional_bank(self, use_local=True):
+        """find regional bank, only from the local aliases"""
+        if not use_local:
+            raise Exception("[error] the async client only finds the regional bank from the local aliases")
+        super().find_regional_bank(use_local=True)
+
+    async def check_session(self):
+        """check the cookies with one request, its response is kept in the cache"""
+        url = self.build_url("operations/synthese/jcr:content.produits-valorisation.json/1")
+        r = await self.request("GET", url, endpoint="produits-valorisation", allow_redirects=False)
+        return self.accept_session(url, r)
+
+    async def request(self, method, url, endpoint=None, **kwargs):
+        """send a request through the connection pool"""
+        start = time.perf_counter()
+        try:
+            async with self.http.request(method, url, **kwargs) as r:
+                rsp = AsyncResponse(r.status, await r.text())
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.record(endpoint or request_metrics.endpoint_name(url), method, url, "error",
+                                    time.perf_counter() - start, error=type(e).__name__)
+            raise
+
+        if self.metrics is not None:
+            self.metrics.record(endpoint or request_metrics.endpoint_name(url), method, url, rsp.status_code,
+                                time.perf_counter() - start, size=request_metrics.response_size(rsp))
+        return rsp
+
+    async def get(self, url, endpoint=None, **kwargs):
+        """get request, cookies are kept by the client"""
+        key = self.cache_key(url, endpoint)
+        if key is not None:
+            text = self.cache.get(key)
+            if text is not None:
+                if self.metrics is not None:
+                    self.metrics.cache_hit(endpoint)
+                return AsyncResponse(200, text)
+
+        r = await self.request("GET", url, endpoint=endpoint, **kwargs)
+        if key is not None and r.status_code == 200:
+            self.cache.set(key, r.text, self.cache_ttl[endpoint])
+        return r
+
+    async def post(self, url, endpoint=None, **kwargs):
+        """post request"""
+        return await self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    async def close(self):
+        """release pooled connections"""
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
+
+    async def authenticate(self):
+        """authenticate user"""
+        # get the keypad layout for the password
+        url = self.build_url("acceder-a-mes-comptes.authenticationKeypad.json")
+        r = await self.post(url=url, endpoint="authenticationKeypad")
+        if r.status_code != 200:
+            raise Exception("[error] keypad: %s - %s" % (r.status_code, r.text))
+
+        rsp = json.loads(r.text)
+        self.keypadId = rsp["keypadId"]
+
+        # authenticate the user
+        url = self.build_url("acceder-a-mes-comptes.html/j_security_check")
+        r2 = await self.post(url=url,
+                             endpoint="j_security_check",
+                             data=self.build_payload(rsp),
+                             headers=authenticator.FORM_HEADERS)
+        if r2.status_code != 200:
+            raise Exception("[error] securitycheck: %s - %s" % (r2.status_code, r2.text))
+
+
+class AsyncAccount(accounts.Account):
+    iter_operations = sync_only("iter_operations")
+
+    async def get_iban(self):
+        """get iban"""
+        return await AsyncIban(session=self.session,
+                               compteIdx=self.compteIdx,
+                               grandeFamilleCode=self.grandeFamilleCode,
+                               numeroCompte=self.numeroCompte)
+
+    async def get_operations(self, date_start=None, date_stop=None, count=100, sleep=None):
+        """get operations"""
+        date_start, date_stop = accounts.default_date_range(date_start, date_stop)
+        return await AsyncOperations(session=self.session,
+                                     compteIdx=self.compteIdx,
+                                     grandeFamilleCode=self.grandeFamilleCode,
+                                     date_start=date_start,
+                                     date_stop=date_stop, count=count, sleep=sleep)
+
+
+class AsyncAccounts(accounts.Accounts):
+    def __init__(self, session):
+        """async accounts class, use `accounts = await AsyncAccounts(session)`"""
+        self.session = session
+        self.accounts_list = []
+        self.loaded = True  # fetched on await
+
+    def __await__(self):
+        """fetch on await"""
+        return self.get_accounts_per_products().__await__()
+
+    async def get_accounts_per_products(self):
+        """get accounts per products, all families are fetched concurrently"""
+        rsps = await asyncio.gather(*[self.session.get(url=self.build_url(f["code"]), endpoint="produits-valorisation")
+                                      for f in accounts.FAMILLE_PRODUITS])
+        for r in rsps:
+            if r.status_code != 200:
+                raise Exception( "[error] get accounts: %s - %s" % (r.status_code, r.text) )
+
+            for descr in json.loads(r.text):
+                self.accounts_list.append( AsyncAccount(self.session, descr) )
+        self.update_index()
+        return self
+
+    get_accounts_per_family = sync_only("get_accounts_per_family")
+
+    async def get_all_operations(self, date_start=None, date_stop=None, max_workers=4, count=None, sleep=None):
+        """operations of every account, fetched concurrently, list of (numeroCompte, operation)
+
+        at most max_workers accounts are fetched at once, operations of an account keep their order
+        """
+        date_start, date_stop = accounts.default_date_range(date_start, date_stop)
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(acc):
+            async with semaphore:
+                return await acc.get_operations(date_start=date_start, date_stop=date_stop, count=count, sleep=sleep)
+
+        results = await asyncio.gather(*[fetch(acc) for acc in self.accounts_list])
+        return [(acc.numeroCompte, op) for acc, ops in zip(self.accounts_list, results) for op in ops]
+
+
+class AsyncOperations(operations.Operations):
+    def __init__(self, session, compteIdx, grandeFamilleCode, date_start, date_stop, count=100, sleep=None,
+                 limit=operations.DEFAULT_LIMIT):
+        """async operations class, use `ops = await AsyncOperations(...)`,
+        limit="auto" uses the page size probed for the regional bank, 30 when unknown"""
+        self.session = session
+        self.compteIdx = compteIdx
+        self.grandeFamilleCode = grandeFamilleCode
+        self.date_start = date_start
+        self.date_stop = date_stop
+        self.list_operations = []
+        self.index = None
+        self.loaded = True  # fetched on await
+        self.count = count
+        self.sleep = sleep
+        self.stream = False
+        self.compact = False
+        self.limit = operations.check_limit(limit)
+        self.exact = False
+
+    def __await__(self):
+        """fetch on await"""
+        return self.get_operations(count=self.count, sleep=self.sleep).__await__()
+
+    get_page = sync_only("get_page")
+    probe_page = sync_only("probe_page")
+    iter_pages = sync_only("iter_pages")
+    iter_operations = sync_only("iter_operations")
+    get_sharded_operations = sync_only("get_sharded_operations")
+
+    async def get_operations(self, count, startIndex=None, limit=None, sleep=None):
+        """get operations according to the date range, count=None fetches every page"""
+        limit = self.page_limit(limit)
+        if limit == "auto":
+            limit = operations.DEFAULT_LIMIT
+        while True:
+            r = await self.session.get(url=self.build_url(startIndex=startIndex, limit=limit), endpoint="n3.operations")
+            if r.status_code != 200:
+                raise Exception( "[error] get operations: %s - %s" % (r.status_code, r.text) )
+
+            rsp = json.loads(r.text)
+            for op in rsp["listeOperations"]:
+                self.list_operations.append( operations.Operation(op) )
+
+            # whole pages until count is reached, every page when count is None
+            if count is not None:
+                count -= limit
+                if count <= 0:
+                    return self
+            if not rsp.get("hasNext") or "nextSetStartIndex" not in rsp:
+                return self
+
+            startIndex = rsp["nextSetStartIndex"]
+            if isinstance(sleep, (int, float)):
+                await asyncio.sleep(sleep)
+
+
+class AsyncDeferredOperations(operations.DeferredOperations):
+    def __init__(self, session, compteIdx, grandeFamilleCode, carteIdx):
+        """async deferred card operations"""
+        self.session = session
+        self.compteIdx = compteIdx
+        self.grandeFamilleCode = grandeFamilleCode
+        self.carteIdx = carteIdx
+        self.list_operations = []
+        self.loaded = True  # fetched on await
+
+    def __await__(self):
+        """fetch on await"""
+        return self.get_operations().__await__()
+
+    async def get_operations(self):
+        """get operations"""
+        r = await self.session.get(url=self.build_url(), endpoint="n3.operations.encours.carte")
+        if r.status_code != 200:
+            raise Exception( "[error] get deffered operations: %s - %s" % (r.status_code, r.text) )
+
+        for op in json.loads(r.text):
+            self.list_operations.append( operations.Operation(op) )
+        return self
+
+
+class AsyncIban(iban.Iban):
+    def __init__(self, session, compteIdx, grandeFamilleCode, numeroCompte):
+        """async iban class"""
+        self.session = session
+        self.compteIdx = compteIdx
+        self.numeroCompte = numeroCompte
+        self.grandeFamilleCode = grandeFamilleCode
+        self.iban = {}
+        self.ibanCode = "-"
+        self.loaded = True  # fetched on await
+
+    def __await__(self):
+        """fetch on await"""
+        return self.get_iban_data().__await__()
+
+    async def get_iban_data(self):
+        """get iban"""
+        r = await self.session.get(url=self.build_url(), endpoint="ibaninformation")
+        if r.status_code != 200:
+            raise Exception( "[error] get accounts: %s - %s" % (r.status_code, r.text) )
+
+        self.iban = json.loads(r.text)
+        self.ibanCode = self.iban["ibanData"]["ibanData"]["ibanCode"]
+        return self
+
+
+class AsyncCard(cards.Card):
+    async def get_operations(self):
+        """get deferred operations"""
+        if not self.session.accounts_index:
+            await AsyncAccounts(session=self.session)
+        account = accounts.find_account(self.session, self.idCompte)
+
+        return await AsyncDeferredOperations(session=self.session,
+                                             compteIdx=account.compteIdx,
+                                             grandeFamilleCode=account.grandeFamilleCode,
+                                             carteIdx=self.card["index"])
+
+
+class AsyncCards(cards.Cards):
+    def __init__(self, session):
+        """async cards class, use `cards = await AsyncCards(session)`"""
+        self.session = session
+        self.cards_list = []
+        self.loaded = True  # fetched on await
+
+    def __await__(self):
+        """fetch on await"""
+        return self.get_cards_per_account().__await__()
+
+    async def get_cards_per_account(self):
+        """get cards per account"""
+        r = await self.session.get(url=self.build_url(), endpoint="listeCartesParCompte")
+        if r.status_code != 200:
+            raise Exception( "[error] get cards: %s - %s" % (r.status_code, r.text) )
+
+        self.parse_cards(json.loads(r.text), card_class=AsyncCard)
+        return self
+
+
+class AsyncLogout(logout.Logout):
+    def __init__(self, session):
+        """async logout class, use `await AsyncLogout(session)`"""
+        self.session = session
+
+    def __await__(self):
+        """logout on await"""
+        return self.logout().__await__()
+
+    async def logout(self):
+        """logout from remote"""
+        r = await self.session.get(url=self.build_url(), endpoint="logout")
+        if r.status_code != 200:
+            raise Exception( "[error] logout: %s - %s" % (r.status_code, r.text) )
+        return self
+
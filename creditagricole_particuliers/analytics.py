@@ -0,0 +1,218 @@
+from datetime import datetime
+
+# numpy is imported on first use by require_numpy
+np = None
+
+from creditagricole_particuliers import accounts
+from creditagricole_particuliers import operations
+
+
+def require_numpy():
+    """import numpy, raise when it is missing"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise Exception("[error] numpy is required for the analytics: pip install numpy")
+        np = numpy
+
+
+def group_sum(codes, values, labels):
+    """sum of values per code, returned as {label: sum}"""
+    sums = np.bincount(codes, weights=values, minlength=len(labels))
+    return {label: round(float(s), 2) for label, s in zip(labels, sums)}
+
+
+class AccountsFrame:
+    def __init__(self, accounts_list=()):
+        """balances of accounts, of one or many customers, in numpy arrays"""
+        require_numpy()
+        self.numeros = []
+        self.soldes = np.empty(0, dtype="float64")
+        self.families = np.empty(0, dtype="int64")
+
+        self.add(accounts_list)
+
+    def __len__(self):
+        """number of accounts"""
+        return len(self.numeros)
+
+    def add(self, accounts_list):
+        """add Account objects, e.g. an Accounts instance"""
+        accounts_list = list(accounts_list)
+        self.numeros.extend(acc.numeroCompte for acc in accounts_list)
+        self.soldes = np.concatenate([self.soldes, np.fromiter((acc.get_solde() for acc in accounts_list),
+                                                              dtype="float64", count=len(accounts_list))])
+        self.families = np.concatenate([self.families, np.fromiter((int(acc.grandeFamilleCode) for acc in accounts_list),
+                                                                  dtype="int64", count=len(accounts_list))])
+        return self
+
+    def solde(self):
+        """global solde"""
+        return round(float(self.soldes.sum()), 2)
+
+    def solde_per_products(self):
+        """solde per products, same result as Accounts.get_solde_per_products"""
+        ret_soldes = {}
+        for f in accounts.FAMILLE_PRODUITS:
+            ret_soldes[f["familleProduit"]] = round(float(self.soldes[self.families == f["code"]].sum()), 2)
+        return ret_soldes
+
+
+class OperationsFrame:
+    def __init__(self):
+        """operations in numpy arrays for vectorized aggregations
+
+        each operation keeps its amount, date, type and the codes of its account,
+        product family and card (-1 when unknown)
+        """
+        require_numpy()
+        self.chunks = []
+        self.frame = None
+        self.codes = {"types": {}, "accounts": {}, "cards": {}}
+        # last day loaded per numeroCompte by load_accounts
+        self.loaded_until = {}
+
+    def __len__(self):
+        """number of operations"""
+        return len(self.columns()["montants"])
+
+    def code(self, column, value):
+        """code of a categorical value"""
+        codes = self.codes[column]
+        if value not in codes:
+            codes[value] = len(codes)
+        return codes[value]
+
+    def labels(self, column):
+        """categorical values ordered by code"""
+        return list(self.codes[column])
+
+    def add(self, ops, account=None, card=None):
+        """add operations, a list of Operation, Operations, DeferredOperations or OperationsColumns
+
+        account: Account owning the operations, card: Card or idCarte of deferred card operations
+        """
+        if isinstance(ops, operations.OperationsColumns):
+            dates = [datetime.fromtimestamp(ts) for ts in ops.dates]
+            montants = np.frombuffer(ops.montants, dtype="float64").copy()
+            used, inverse = np.unique(np.frombuffer(ops.types, dtype="uint32"), return_inverse=True)
+            types = np.array([self.code("types", ops.strings[u]) for u in used], dtype="int64")[inverse.ravel()]
+        else:
+            ops = list(ops)
+            dates = [o.dateOperation for o in ops]
+            montants = np.fromiter((float(o.montantOp) for o in ops), dtype="float64", count=len(ops))
+            # CompactOperation keeps the type as an attribute, its descr is rebuilt on each access
+            types = np.fromiter((self.code("types", o.libelleTypeOperation if hasattr(o, "libelleTypeOperation")
+                                           else o.descr.get("libelleTypeOperation", "")) for o in ops),
+                                dtype="int64", count=len(ops))
+
+        n = len(montants)
+        account_code = self.code("accounts", account.numeroCompte) if account is not None else -1
+        family = int(account.grandeFamilleCode) if account is not None else -1
+        if card is not None:
+            card_code = self.code("cards", getattr(card, "idCarte", card))
+        else:
+            card_code = -1
+
+        self.chunks.append({"dates": np.array(dates, dtype="datetime64[s]"),
+                            "montants": montants,
+                            "types": types,
+                            "accounts": np.full(n, account_code, dtype="int64"),
+                            "families": np.full(n, family, dtype="int64"),
+                            "cards": np.full(n, card_code, dtype="int64")})
+        self.frame = None
+        return self
+
+    def load_accounts(self, accounts_list, date_start=None, date_stop=None, count=None, max_workers=4):
+        """add the operations of every account, fetched concurrently"""
+        date_start, date_stop = accounts.default_date_range(date_start, date_stop)
+        per_account = {}
+        for numeroCompte, op in accounts_list.get_all_operations(date_start=date_start, date_stop=date_stop,
+                                                                 count=count, max_workers=max_workers, compact=True):
+            per_account.setdefault(numeroCompte, []).append(op)
+        for acc in accounts_list:
+            self.add(per_account.get(acc.numeroCompte, []), account=acc)
+            self.loaded_until[acc.numeroCompte] = max(date_stop, self.loaded_until.get(acc.numeroCompte, date_stop))
+        return self
+
+    def load_cards(self, cards_list):
+        """add the deferred operations of every card"""
+        for card in cards_list:
+            account = accounts.find_account(card.session, card.idCompte)
+            self.add(card.get_operations(), account=account, card=card)
+        return self
+
+    def columns(self):
+        """concatenated arrays of the operations"""
+        if self.frame is None:
+            names = ["dates", "montants", "types", "accounts", "families", "cards"]
+            if self.chunks:
+                self.frame = {name: np.concatenate([c[name] for c in self.chunks]) for name in names}
+            else:
+                self.frame = {name: np.empty(0, dtype="datetime64[s]" if name == "dates" else "int64") for name in names}
+                self.frame["montants"] = np.empty(0, dtype="float64")
+            self.chunks = [self.frame]
+        return self.frame
+
+    def total(self):
+        """sum of the amounts"""
+        return round(float(self.columns()["montants"].sum()), 2)
+
+    def sum_per_month(self):
+        """sum of the amounts per month, {"YYYY-MM": sum} sorted by month"""
+        c = self.columns()
+        months, codes = np.unique(c["dates"].astype("datetime64[M]"), return_inverse=True)
+        return group_sum(codes.ravel(), c["montants"], [str(m) for m in months])
+
+    def sum_per_type(self):
+        """sum of the amounts per libelleTypeOperation"""
+        c = self.columns()
+        return group_sum(c["types"], c["montants"], self.labels("types"))
+
+    def sum_per_account(self):
+        """sum of the amounts per numeroCompte"""
+        c = self.columns()
+        known = c["accounts"] >= 0
+        return group_sum(c["accounts"][known], c["montants"][known], self.labels("accounts"))
+
+    def sum_per_card(self):
+        """sum of the deferred card operations per idCarte"""
+        c = self.columns()
+        known = c["cards"] >= 0
+        return group_sum(c["cards"][known], c["montants"][known], self.labels("cards"))
+
+    def sum_per_products(self):
+        """sum of the amounts per product family"""
+        c = self.columns()
+        ret_sums = {}
+        for f in accounts.FAMILLE_PRODUITS:
+            ret_sums[f["familleProduit"]] = round(float(c["montants"][c["families"] == f["code"]].sum()), 2)
+        return ret_sums
+
+    def running_balance(self, account=None, solde=None):
+        """balance after each operation, return (dates, balances) sorted by date
+
+        account: only the operations of this Account, its solde ends the balance when solde is None
+        solde: balance at the end of the loaded range, required with account when the operations
+        of the account were not loaded up to today by load_accounts, get_solde is today's balance
+        deferred card operations are left out, they are not debited yet
+        """
+        c = self.columns()
+        selected = c["cards"] < 0
+        if account is not None:
+            selected &= c["accounts"] == self.codes["accounts"].get(account.numeroCompte, -2)
+            if solde is None:
+                today = datetime.today().strftime('%Y-%m-%d')
+                if self.loaded_until.get(account.numeroCompte, "") < today:
+                    raise Exception("[error] running balance: operations of %s are not loaded up to today, give the solde "
+                                    "at the end of the range" % account.numeroCompte)
+                solde = account.get_solde()
+
+        dates = c["dates"][selected]
+        order = np.argsort(dates, kind="stable")
+        balances = np.cumsum(c["montants"][selected][order])
+        if solde is not None and len(balances):
+            balances += solde - balances[-1]
+        return dates[order], np.round(balances, 2)
@@ -2,13 +2,55 @@ from urllib import parse
 import requests
 import json
 import os
+import threading
+import time
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = ValueError
 
 from creditagricole_particuliers import regionalbanks
+from creditagricole_particuliers import cache as responses_cache
+from creditagricole_particuliers import metrics as request_metrics
+from creditagricole_particuliers import transport as transports
+
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
+
+# profiler of the session that last sent a request on each thread, see profiling.Profiler
+PROFILER_CONTEXT = threading.local()
 
 
 class Authenticator:
-    def __init__(self, username, password, department):
-        """authenticator class"""
+    def __init__(self, username, password, department, pool_size=10, retries=3, timeout=30,
+                 cache=None, cache_ttl=None, transport=None, session_file=None, session_key=None,
+                 semaphore=None, limiter=None, metrics=None):
+        """authenticator class, with session_file the cookies are reused between runs,
+        semaphore caps the requests in flight shared with other sessions,
+        limiter is a RateLimiter enforcing a requests per second budget,
+        metrics is a Metrics instance recording every request"""
+        if (session_file is None) != (session_key is None):
+            raise Exception("[error] session_file and session_key must be given together")
+
+        # keep-alive connection pool shared by all resources, or a replay of the samples
+        # the limiter retries the 5xx responses itself, the pool only retries the network errors
+        if transport is None:
+            transport = transports.HttpTransport(pool_size=pool_size, retries=retries,
+                                                 status_forcelist=[] if limiter is not None else transports.RETRY_STATUS)
+        self.setup(username, password, department, timeout=timeout, cache=cache, cache_ttl=cache_ttl,
+                   transport=transport, semaphore=semaphore, limiter=limiter, metrics=metrics)
+
+        self.find_regional_bank()
+        if session_file is None:
+            self.authenticate()
+        elif not self.restore_session(session_file, session_key):
+            self.authenticate()
+            self.export_session(session_file, session_key)
+
+    def setup(self, username, password, department, timeout=30, cache=None, cache_ttl=None,
+              transport=None, semaphore=None, limiter=None, metrics=None):
+        """attributes of a session before the login, shared with the async client"""
         self.url = "https://www.credit-agricole.fr"
         self.ssl_verify = True
         self.username = username
@@ -16,22 +58,23 @@ class Authenticator:
         self.department = department
         self.regional_bank_url = "ca-undefined"
         self.cookies = None
-
-        self.find_regional_bank()
-        self.authenticate()
+        self.timeout = timeout
+        self.accounts_index = {}
+        self.transport = transport
+        self.semaphore = semaphore
+        self.limiter = limiter
+        self.metrics = metrics
+        self.profiler = None
+        self.setup_cache(cache, cache_ttl)
 
     def find_regional_bank(self, use_local=True):
         """find regional bank"""
 
         if use_local:
-            filepath = os.path.join(os.path.dirname(__file__), r"aliases.json")
-            with open(filepath, "r") as f:
-                aliases = json.load(f)
-
-            self.regional_bank_url = aliases[str(self.department).zfill(2)]["alias"]
+            self.regional_bank_url = regionalbanks.find_alias(self.department)
 
         else:
-            regional_bank = regionalbanks.RegionalBanks().by_departement(department=self.department)
+            regional_bank = regionalbanks.RegionalBanks(session=self).by_departement(department=self.department)
             if "regionalBankUrlPrefix" not in regional_bank:
                 raise Exception("[error] regionalBankUrlPrefix key is missing")
 
@@ -45,43 +88,207 @@ class Authenticator:
                 return i
             i += 1
 
-    def authenticate(self):
-        """authenticate user"""
-        # get the keypad layout for the password
-        url = "%s/%s/particulier/" % (self.url, self.regional_bank_url)
-        url += "acceder-a-mes-comptes.authenticationKeypad.json"
-        r = requests.post(url=url,
-                          verify=self.ssl_verify)
-        if r.status_code != 200:
-            raise Exception("[error] keypad: %s - %s" % (r.status_code, r.text))
+    def setup_cache(self, cache=None, cache_ttl=None):
+        """response cache, in-memory by default, cache=False to disable"""
+        if cache is None:
+            cache = responses_cache.MemoryCache()
+        self.cache = cache or None
+        self.cache_ttl = dict(responses_cache.DEFAULT_TTL)
+        self.cache_ttl.update(cache_ttl or {})
 
-        self.cookies = r.cookies
-        rsp = json.loads(r.text)
-        self.keypadId = rsp["keypadId"]
+    def cache_key(self, url, endpoint):
+        """cache key of a get request, None when not cacheable"""
+        if self.cache is None or not self.cache_ttl.get(endpoint):
+            return None
+        return "%s|%s|%s" % (endpoint, self.username, url)
+
+    def invalidate(self, endpoint=None):
+        """drop the cached responses of an endpoint, or all of them"""
+        if self.cache is not None:
+            self.cache.invalidate(endpoint)
+
+    def cache_stats(self):
+        """cache hit/miss counters"""
+        if self.cache is None:
+            return {"hits": 0, "misses": 0, "size": 0}
+        return self.cache.stats()
+
+    def send(self, method, url, **kwargs):
+        """send a request through the transport, timed as the transfer phase when profiled"""
+        if self.profiler is not None:
+            return self.profiler.call("transfer", self.send_transport, method, url, **kwargs)
+        return self.send_transport(method, url, **kwargs)
+
+    def send_transport(self, method, url, **kwargs):
+        """send a request through the transport, under the semaphore when set"""
+        if self.semaphore is not None:
+            with self.semaphore:
+                return self.transport.request(method=method, url=url, **kwargs)
+        return self.transport.request(method=method, url=url, **kwargs)
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """send a request through the connection pool, under the rate limiter when set"""
+        # the phases that follow on this thread belong to the profiler of this session, if any
+        PROFILER_CONTEXT.profiler = self.profiler
+        kwargs.setdefault("verify", self.ssl_verify)
+        kwargs.setdefault("timeout", self.timeout)
+        if self.metrics is None:
+            if self.limiter is not None:
+                return self.limiter.send(method, lambda: self.send(method, url, **kwargs))
+            return self.send(method, url, **kwargs)
+
+        attempts = []
+        def send():
+            attempts.append(method)
+            return self.send(method, url, **kwargs)
+
+        endpoint = endpoint or request_metrics.endpoint_name(url)
+        start = time.perf_counter()
+        try:
+            r = self.limiter.send(method, send) if self.limiter is not None else send()
+        except Exception as e:
+            self.metrics.record(endpoint, method, url, "error", time.perf_counter() - start,
+                                retries=max(0, len(attempts) - 1), error=type(e).__name__)
+            raise
+
+        # retries of the limiter, and of the connection pool for 502, 503 and 504 responses
+        pool_retries = getattr(getattr(getattr(r, "raw", None), "retries", None), "history", None) or ()
+        self.metrics.record(endpoint, method, url, r.status_code, time.perf_counter() - start,
+                            size=request_metrics.response_size(r),
+                            retries=len(attempts) - 1 + len(pool_retries))
+        return r
+
+    def get(self, url, endpoint=None, **kwargs):
+        """get request with the session cookies, served from the cache when possible"""
+        key = self.cache_key(url, endpoint)
+        if key is not None:
+            text = self.cache.get(key)
+            if text is not None:
+                if self.metrics is not None:
+                    self.metrics.cache_hit(endpoint)
+                return responses_cache.CachedResponse(text)
+
+        kwargs.setdefault("cookies", self.cookies)
+        r = self.request("GET", url, endpoint=endpoint, **kwargs)
+        if key is not None and r.status_code == 200:
+            self.cache.set(key, r.text, self.cache_ttl[endpoint])
+        return r
 
+    def post(self, url, endpoint=None, **kwargs):
+        """post request"""
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    def close(self):
+        """release pooled connections"""
+        self.transport.close()
+
+    def invalidate_accounts(self):
+        """clear the accounts index, the next lookup fetches the accounts again"""
+        self.accounts_index = {}
+
+    def build_url(self, page):
+        """build url of an authentication page"""
+        return "%s/%s/particulier/%s" % (self.url, self.regional_bank_url, page)
+
+    def build_payload(self, keypad):
+        """compute the security check form according to the keypad layout"""
         # compute the password according to the layout
         j_password = []
         for d in self.password:
-            k = self.map_digit(key_layout=rsp["keyLayout"], digit=d)
+            k = self.map_digit(key_layout=keypad["keyLayout"], digit=d)
             j_password.append("%s" % k)
 
-        # authenticate the user
-        url = "%s/%s/particulier/" % (self.url, self.regional_bank_url)
-        url += "acceder-a-mes-comptes.html/j_security_check"
-        headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
         payload = {'j_password': ",".join(j_password),
                    'path': '/content/npc/start',
                    'j_path_ressource': '%%2F%s%%2Fparticulier%%2Foperations%%2Fsynthese.html' % self.regional_bank_url,
                    'j_username': self.username,
-                   'keypadId': rsp["keypadId"],
+                   'keypadId': keypad["keypadId"],
                    'j_validate': "true"}
-        r2 = requests.post(url=url,
-                           data=parse.urlencode(payload),
-                           headers=headers,
-                           verify=self.ssl_verify,
-                           cookies=r.cookies)
+        return parse.urlencode(payload)
+
+    def authenticate(self):
+        """authenticate user"""
+        # get the keypad layout for the password
+        url = self.build_url("acceder-a-mes-comptes.authenticationKeypad.json")
+        r = self.post(url=url, endpoint="authenticationKeypad")
+        if r.status_code != 200:
+            raise Exception("[error] keypad: %s - %s" % (r.status_code, r.text))
+
+        self.cookies = r.cookies
+        rsp = json.loads(r.text)
+        self.keypadId = rsp["keypadId"]
+
+        # authenticate the user
+        url = self.build_url("acceder-a-mes-comptes.html/j_security_check")
+        r2 = self.post(url=url,
+                       endpoint="j_security_check",
+                       data=self.build_payload(rsp),
+                       headers=FORM_HEADERS,
+                       cookies=r.cookies)
         if r2.status_code != 200:
             raise Exception("[error] securitycheck: %s - %s" % (r2.status_code, r2.text))
 
         # success, extract cookies and save-it
         self.cookies = requests.cookies.merge_cookies(self.cookies, r2.cookies)
+
+    def fernet(self, key):
+        """cipher of the session file"""
+        if Fernet is None:
+            raise Exception("[error] cryptography is required to save the session: pip install cryptography")
+        return Fernet(key)
+
+    def export_session(self, path, key):
+        """save the authenticated cookies, encrypted with a Fernet key"""
+        cookies = [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                    "secure": c.secure, "expires": c.expires} for c in self.cookies]
+        data = json.dumps({"username": self.username,
+                           "regional_bank_url": self.regional_bank_url,
+                           "cookies": cookies})
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.fernet(key).encrypt(data.encode()))
+
+    def import_session(self, path, key):
+        """load cookies saved by export_session"""
+        with open(path, "rb") as f:
+            data = json.loads(self.fernet(key).decrypt(f.read()))
+        if data["username"] != self.username:
+            raise ValueError("[error] session file of another user")
+
+        self.regional_bank_url = data["regional_bank_url"]
+        self.cookies = requests.cookies.RequestsCookieJar()
+        for c in data["cookies"]:
+            self.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"],
+                             secure=c["secure"], expires=c["expires"])
+
+    def check_session(self):
+        """check the cookies with one request, its response is kept in the cache"""
+        url = self.build_url("operations/synthese/jcr:content.produits-valorisation.json/1")
+        r = self.request("GET", url, endpoint="produits-valorisation", cookies=self.cookies, allow_redirects=False)
+        return self.accept_session(url, r)
+
+    def accept_session(self, url, r):
+        """True when the response of check_session shows a valid session, keep it in the cache"""
+        if r.status_code != 200:
+            return False
+        try:
+            if not isinstance(json.loads(r.text), list):
+                return False
+        except ValueError:
+            return False
+
+        key = self.cache_key(url, "produits-valorisation")
+        if key is not None:
+            self.cache.set(key, r.text, self.cache_ttl["produits-valorisation"])
+        return True
+
+    def restore_session(self, path, key):
+        """reuse a saved session, False when missing, expired, unreadable or of another user"""
+        if not os.path.exists(path):
+            return False
+        try:
+            self.import_session(path, key)
+        except (InvalidToken, ValueError, KeyError):
+            return False
+        return self.check_session()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = ValueError
+
+# time to live in seconds per endpoint, endpoints not listed are never cached
+DEFAULT_TTL = {
+    "ibaninformation": 86400,
+    "produits-valorisation": 60,
+    "listeCartesParCompte": 60,
+}
+
+
+class CachedResponse:
+    def __init__(self, text, status_code=200):
+        """response served from the cache"""
+        self.status_code = status_code
+        self.text = text
+
+
+class MemoryCache:
+    def __init__(self, maxsize=256):
+        """in-memory LRU cache of response bodies"""
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, key):
+        """return (expires, text) or None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def write(self, key, expires, text):
+        """save an entry, evict the least recently used ones"""
+        self.entries[key] = (expires, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def delete(self, key):
+        """remove an entry"""
+        self.entries.pop(key, None)
+
+    def keys(self):
+        """list the keys"""
+        return list(self.entries)
+
+    def get(self, key):
+        """return the cached text or None when missing or expired"""
+        with self.lock:
+            entry = self.read(key)
+            if entry is not None and entry[0] < time.time():
+                self.delete(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, text, ttl):
+        """cache the text for ttl seconds"""
+        with self.lock:
+            self.write(key, time.time() + ttl, text)
+
+    def invalidate(self, endpoint=None):
+        """drop the entries of an endpoint, or everything"""
+        with self.lock:
+            for key in self.keys():
+                if endpoint is None or key.startswith("%s|" % endpoint):
+                    self.delete(key)
+
+    def stats(self):
+        """hits and misses counters"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.keys())}
+
+
+class DiskCache(MemoryCache):
+    def __init__(self, path, key=None):
+        """on-disk cache, one json file per entry, kept between runs
+
+        the files are only readable by their owner, encrypted with a Fernet key when given
+        """
+        super().__init__(maxsize=None)
+        self.path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        os.chmod(path, 0o700)
+
+        self.fernet = None
+        if key is not None:
+            if Fernet is None:
+                raise Exception("[error] cryptography is required to encrypt the cache: pip install cryptography")
+            self.fernet = Fernet(key)
+
+    def filename(self, key):
+        """file of a key"""
+        return os.path.join(self.path, "%s.json" % hashlib.sha256(key.encode()).hexdigest())
+
+    def load(self, filename):
+        """entry of a file"""
+        with open(filename, "rb") as f:
+            data = f.read()
+        if self.fernet is not None:
+            data = self.fernet.decrypt(data)
+        return json.loads(data)
+
+    def read(self, key):
+        """return (expires, text) or None"""
+        try:
+            entry = self.load(self.filename(key))
+        except (OSError, ValueError, InvalidToken):
+            return None
+        return entry["expires"], entry["text"]
+
+    def write(self, key, expires, text):
+        """save an entry"""
+        data = json.dumps({"key": key, "expires": expires, "text": text}).encode()
+        if self.fernet is not None:
+            data = self.fernet.encrypt(data)
+
+        fd = os.open(self.filename(key), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+    def delete(self, key):
+        """remove an entry"""
+        try:
+            os.remove(self.filename(key))
+        except OSError:
+            pass
+
+    def keys(self):
+        """list the keys"""
+        keys = []
+        for name in os.listdir(self.path):
+            try:
+                keys.append(self.load(os.path.join(self.path, name))["key"])
+            except (OSError, ValueError, KeyError, InvalidToken):
+                continue
+        return keys
@@ -1,7 +1,8 @@
 from json.encoder import py_encode_basestring_ascii
-import requests
+import io
 import json
 
+from creditagricole_particuliers import export
 from creditagricole_particuliers import operations
 from creditagricole_particuliers import accounts
 
@@ -19,31 +20,42 @@ class Card:
         """str"""
         return f"Carte[compte={self.idCompte}, type={self.typeCarte}, titulaire={self.titulaire}]"
 
-    def get_operations(self):
+    def get_operations(self, lazy=False):
         """get deferred operations"""
-        # search account
-        account = accounts.Accounts(session=self.session).search(num=self.idCompte)
+        # search account in the session index
+        account = accounts.find_account(self.session, self.idCompte)
 
         # return associated operations
         return operations.DeferredOperations(session=self.session, 
                                              compteIdx=account.compteIdx,
                                              grandeFamilleCode=account.grandeFamilleCode,
-                                             carteIdx=self.card["index"])
+                                             carteIdx=self.card["index"],
+                                             lazy=lazy)
 
     def as_json(self):
         """return as json"""
         return json.dumps(self.card)
 
 class Cards:
-    def __init__(self, session):
-        """cards class"""
+    def __init__(self, session, lazy=False):
+        """cards class, with lazy=True the cards are fetched on first access"""
         self.session = session
         self.cards_list = []
+        self.loaded = False
 
-        self.get_cards_per_account()
+        if not lazy:
+            self.load()
+
+    def load(self):
+        """fetch the cards on first access"""
+        if not self.loaded:
+            self.get_cards_per_account()
+            self.loaded = True
+        return self
 
     def __iter__(self):
         """iter"""
+        self.load()
         self.n = 0
         return self
 
@@ -58,35 +70,45 @@ class Cards:
 
     def as_json(self):
         """as json"""
-        _accs = []
-        for acc in self.cards_list:
-            _accs.append(acc.card)
-        return json.dumps(_accs)
+        self.load()
+        fp = io.StringIO()
+        export.write_json(self.cards_list, fp, backend="json")
+        return fp.getvalue()
+
+    def export(self, fp, fmt="ndjson", **kwargs):
+        """write the cards to a file-like object, see export.write"""
+        return export.write(self.load().cards_list, fp, fmt, **kwargs)
 
     def search(self, num_last_digits):
         """search card """
+        self.load()
         for cb in self.cards_list:
             if cb.idCarte.endswith(num_last_digits):
                 return cb
         raise Exception( "[error] card not found" )
 
 
-    def get_cards_per_account(self):
-        """get cards per account"""
+    def build_url(self):
+        """build url of the cards"""
         url = "%s" % self.session.url
         url += "/%s/particulier/operations/" % self.session.regional_bank_url
         url += "moyens-paiement/gestion-carte-v2/mes-cartes/jcr:content.listeCartesParCompte.json"
-        r = requests.get(url=url,
-                         verify=self.session.ssl_verify,
-                         cookies=self.session.cookies)
+        return url
+
+    def get_cards_per_account(self):
+        """get cards per account"""
+        r = self.session.get(url=self.build_url(), endpoint="listeCartesParCompte")
         if r.status_code != 200:
             raise Exception( "[error] get cards: %s - %s" % (r.status_code, r.text) )
 
-        r = json.loads(r.text)
-        if "comptes" not in r:
+        self.parse_cards(json.loads(r.text))
+
+    def parse_cards(self, rsp, card_class=Card):
+        """populate cards_list from the cards response"""
+        if "comptes" not in rsp:
             raise Exception("[error] compte not found in response ")
 
-        for account in r["comptes"]:
+        for account in rsp["comptes"]:
             for card in account["listeCartes"]:
                 card["idCompte"] = account["idCompte"]
-                self.cards_list.append( Card(self.session, card) )
+                self.cards_list.append( card_class(self.session, card) )
@@ -0,0 +1,219 @@
+import csv
+import itertools
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pyarrow is imported on first use by require_pyarrow
+pa = None
+pq = None
+
+from creditagricole_particuliers import operations
+
+FORMATS = ["ndjson", "json", "csv", "parquet", "arrow"]
+
+# columns of samples/types/account_00000000000_operations_types.json and datePrelevement of the card operations,
+# category columns are dictionary encoded
+OPERATION_FIELDS = [("dateOperation", "timestamp"),
+                    ("dateValeur", "timestamp"),
+                    ("datePrelevement", "timestamp"),
+                    ("typeOperation", "category"),
+                    ("codeTypeOperation", "category"),
+                    ("familleTypeOperation", "category"),
+                    ("libelleOperation", "string"),
+                    ("libelleTypeOperation", "category"),
+                    ("montant", "float"),
+                    ("idDevise", "category"),
+                    ("libelleDevise", "category"),
+                    ("libelleComplementaire", "string"),
+                    ("referenceMandat", "string"),
+                    ("idCreancier", "category"),
+                    ("libelleCash1", "string"),
+                    ("libelleCash2", "string"),
+                    ("idCarte", "category"),
+                    ("indexCarte", "int"),
+                    ("referenceClient", "string"),
+                    ("pictogrammeCSS", "category"),
+                    ("fitid", "string"),
+                    ("numeroCompte", "category")]
+
+
+def dumps(obj, backend=None):
+    """json of an object, backend "orjson" or "json", orjson by default when installed"""
+    if backend is None:
+        backend = "orjson" if orjson is not None else "json"
+    if backend == "orjson":
+        if orjson is None:
+            raise Exception("[error] orjson is not installed: pip install orjson")
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def describe(item):
+    """raw dict of an operation, account or card
+
+    (numeroCompte, operation) tuples from Accounts.get_all_operations get a numeroCompte field
+    """
+    if isinstance(item, tuple):
+        numeroCompte, item = item
+        return dict(describe(item), numeroCompte=numeroCompte)
+    for attr in ("descr", "account", "card"):
+        if hasattr(item, attr):
+            return getattr(item, attr)
+    return item
+
+
+def write_ndjson(items, fp, backend=None):
+    """write one json document per line, return the number of items written"""
+    n = 0
+    for item in items:
+        fp.write(dumps(describe(item), backend))
+        fp.write("\n")
+        n += 1
+    return n
+
+
+def write_json(items, fp, backend=None):
+    """write a json array item by item, return the number of items written"""
+    n = 0
+    fp.write("[")
+    for item in items:
+        if n:
+            fp.write(", ")
+        fp.write(dumps(describe(item), backend))
+        n += 1
+    fp.write("]")
+    return n
+
+
+def write_csv(items, fp, fields=None, backend=None):
+    """write csv rows, return the number of items written
+
+    fields: columns, the keys of the first item by default
+    nested values are written as json, fp should be opened with newline=""
+    """
+    rows = (describe(item) for item in items)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    if fields is None:
+        fields = list(first)
+
+    writer = csv.DictWriter(fp, fieldnames=fields, restval="", extrasaction="ignore")
+    writer.writeheader()
+    n = 0
+    for row in itertools.chain([first], rows):
+        writer.writerow({k: dumps(v, backend) if isinstance(v, (dict, list)) else v for k, v in row.items()})
+        n += 1
+    return n
+
+
+def require_pyarrow():
+    """import pyarrow, raise when it is missing"""
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("[error] pyarrow is required for the parquet and arrow exports: pip install pyarrow")
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def operations_schema():
+    """arrow schema of the operations"""
+    require_pyarrow()
+    types = {"timestamp": pa.timestamp("s"),
+             "float": pa.float64(),
+             "int": pa.int64(),
+             "category": pa.dictionary(pa.int32(), pa.string()),
+             "string": pa.string()}
+    return pa.schema([(name, types[kind]) for name, kind in OPERATION_FIELDS])
+
+
+def convert(value, kind):
+    """typed value of an operation field, None when missing"""
+    if value is None or value == "":
+        return None
+    if kind == "timestamp":
+        return operations.parse_date(value)
+    if kind == "float":
+        return float(value)
+    if kind == "int":
+        return int(value)
+    return str(value)
+
+
+def record_batch(items, schema):
+    """arrow record batch of operations"""
+    rows = [describe(item) for item in items]
+    arrays = []
+    for name, kind in OPERATION_FIELDS:
+        values = [convert(row.get(name), kind) for row in rows]
+        if kind == "category":
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=schema.field(name).type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iter_batches(items, batch_size):
+    """lists of batch_size items"""
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def to_arrow(items):
+    """arrow table of operations"""
+    schema = operations_schema()
+    return pa.Table.from_batches([record_batch(batch, schema) for batch in iter_batches(items, 10000)], schema=schema)
+
+
+def write_parquet(items, fp, batch_size=10000, compression="snappy"):
+    """write operations to parquet, one row group per batch_size operations, return the number written
+
+    fp is a path or a binary file-like object, batches are written as soon as they are full
+    """
+    schema = operations_schema()
+    writer = pq.ParquetWriter(fp, schema, compression=compression)
+    n = 0
+    try:
+        for batch in iter_batches(items, batch_size):
+            writer.write_batch(record_batch(batch, schema), row_group_size=batch_size)
+            n += len(batch)
+    finally:
+        writer.close()
+    return n
+
+
+def write_arrow(items, fp, batch_size=10000):
+    """write operations to an arrow ipc stream, one record batch per batch_size operations, return the number written"""
+    schema = operations_schema()
+    n = 0
+    with pa.ipc.new_stream(fp, schema) as writer:
+        for batch in iter_batches(items, batch_size):
+            writer.write_batch(record_batch(batch, schema))
+            n += len(batch)
+    return n
+
+
+def write(items, fp, fmt="ndjson", **kwargs):
+    """write items to a file-like object in one of FORMATS, parquet and arrow need a binary file or a path"""
+    if fmt == "ndjson":
+        return write_ndjson(items, fp, **kwargs)
+    if fmt == "json":
+        return write_json(items, fp, **kwargs)
+    if fmt == "csv":
+        return write_csv(items, fp, **kwargs)
+    if fmt == "parquet":
+        return write_parquet(items, fp, **kwargs)
+    if fmt == "arrow":
+        return write_arrow(items, fp, **kwargs)
+    raise Exception( "[error] unknown export format: %s, expected one of %s" % (fmt, ", ".join(FORMATS)) )
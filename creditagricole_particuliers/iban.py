@@ -1,32 +1,46 @@
 import json
-import requests
 
 class Iban:
-    def __init__(self, session, compteIdx, grandeFamilleCode, numeroCompte):
-        """class init"""
+    def __init__(self, session, compteIdx, grandeFamilleCode, numeroCompte, lazy=False):
+        """class init, with lazy=True the iban is fetched on first access"""
         self.session = session
         self.compteIdx = compteIdx
         self.numeroCompte = numeroCompte
         self.grandeFamilleCode = grandeFamilleCode
-        self.iban = {}
-        self.ibanCode = "-"
+        self.loaded = False
 
-        self.get_iban_data()
+        if not lazy:
+            self.load()
+
+    def __getattr__(self, name):
+        """fetch the iban on first access of its data"""
+        if name in ("iban", "ibanCode") and not self.__dict__.get("loaded", True):
+            self.load()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def load(self):
+        """fetch the iban on first access"""
+        if not self.loaded:
+            self.get_iban_data()
+            self.loaded = True
+        return self
 
     def __str__(self):
         """stre representation"""
         return f"Iban[compte={self.numeroCompte}, code={self.ibanCode}]"
 
-    def get_iban_data(self):
-        """get iban"""
+    def build_url(self):
+        """build url of the iban"""
         url = "%s" % self.session.url
         url += "/%s/particulier/operations/" % self.session.regional_bank_url
         url += "operations-courantes/editer-rib/"
         url += "jcr:content.ibaninformation.json?compteIdx=%s&grandeFamilleCode=%s" % (self.compteIdx,self.grandeFamilleCode)
+        return url
 
-        r = requests.get(url=url,
-                        verify=self.session.ssl_verify,
-                        cookies=self.session.cookies)
+    def get_iban_data(self):
+        """get iban"""
+        r = self.session.get(url=self.build_url(), endpoint="ibaninformation")
         if r.status_code != 200:
             raise Exception( "[error] get accounts: %s - %s" % (r.status_code, r.text) )
 
@@ -1,18 +1,18 @@
-import requests
-
 class Logout:
     def __init__(self, session):
         """logout class"""
         self.session = session
         self.logout()
         
-    def logout(self):
-        """logout from remote"""
+    def build_url(self):
+        """build url of the logout"""
         url = "%s" % self.session.url
         url += "/%s/particulier.npc.logout.html?resource=" % self.session.regional_bank_url
         url += "/content/ca/cr866/npc/fr/particulier.html"
-        r = requests.get(url=url,
-                         verify=self.session.ssl_verify,
-                         cookies=self.session.cookies)
+        return url
+
+    def logout(self):
+        """logout from remote"""
+        r = self.session.get(url=self.build_url(), endpoint="logout")
         if r.status_code != 200:
             raise Exception( "[error] logout: %s - %s" % (r.status_code, r.text) )
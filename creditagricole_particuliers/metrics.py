@@ -0,0 +1,152 @@
+import re
+import threading
+from urllib import parse
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+
+def endpoint_name(url):
+    """endpoint of an url when none is given, e.g. "n3.operations" for jcr:content.n3.operations.json"""
+    path = parse.urlsplit(url).path
+    m = re.search(r"jcr:content\.(.+?)\.json", path)
+    if m:
+        return m.group(1)
+    return path.rstrip("/").rsplit("/", 1)[-1] or "/"
+
+
+def response_size(r):
+    """bytes of a response body"""
+    content = getattr(r, "content", None)
+    if isinstance(content, bytes):
+        return len(content)
+    return len((getattr(r, "text", None) or "").encode())
+
+
+def escape(value):
+    """prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        """cumulative histogram with fixed buckets"""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """add a value"""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, prefix="creditagricole"):
+        """counters and histograms of the requests, shared by any number of sessions
+
+        sessions created with Authenticator(metrics=...) record one event per request:
+        {"endpoint", "method", "url", "status", "latency", "bytes", "retries", "error"}
+        """
+        self.prefix = prefix
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """clear the counters"""
+        with self.lock:
+            self.requests = {}
+            self.retries = {}
+            self.bytes = {}
+            self.cache_hits = {}
+            self.latency = {}
+            self.sizes = {}
+
+    def add_hook(self, func):
+        """call func(event) after each request"""
+        self.hooks.append(func)
+        return func
+
+    def remove_hook(self, func):
+        """stop calling func"""
+        self.hooks.remove(func)
+
+    def record(self, endpoint, method, url, status, latency, size=0, retries=0, error=None):
+        """record one request and call the hooks"""
+        event = {"endpoint": endpoint, "method": method, "url": url, "status": status,
+                 "latency": latency, "bytes": size, "retries": retries, "error": error}
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.retries[endpoint] = self.retries.get(endpoint, 0) + retries
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + size
+            self.latency.setdefault(endpoint, Histogram(LATENCY_BUCKETS)).observe(latency)
+            self.sizes.setdefault(endpoint, Histogram(SIZE_BUCKETS)).observe(size)
+        for hook in self.hooks:
+            hook(event)
+        return event
+
+    def cache_hit(self, endpoint):
+        """count a response served from the cache"""
+        with self.lock:
+            self.cache_hits[endpoint] = self.cache_hits.get(endpoint, 0) + 1
+
+    def summary(self):
+        """per endpoint totals sorted by time spent, the most expensive endpoint first"""
+        with self.lock:
+            endpoints = {}
+            for (endpoint, method, status), n in self.requests.items():
+                e = endpoints.setdefault(endpoint, {"requests": 0, "errors": 0})
+                e["requests"] += n
+                if status == "error" or int(status) >= 400:
+                    e["errors"] += n
+            for endpoint, e in endpoints.items():
+                h = self.latency[endpoint]
+                e["seconds"] = round(h.sum, 6)
+                e["mean_ms"] = round(h.sum / h.count * 1000, 3)
+                e["bytes"] = self.bytes[endpoint]
+                e["retries"] = self.retries[endpoint]
+                e["cache_hits"] = self.cache_hits.get(endpoint, 0)
+            for endpoint, n in self.cache_hits.items():
+                if endpoint not in endpoints:
+                    endpoints[endpoint] = {"requests": 0, "errors": 0, "seconds": 0.0, "mean_ms": 0.0,
+                                           "bytes": 0, "retries": 0, "cache_hits": n}
+        return dict(sorted(endpoints.items(), key=lambda item: item[1]["seconds"], reverse=True))
+
+    def prometheus(self):
+        """counters and histograms in the prometheus text format"""
+        p = self.prefix
+        lines = []
+        with self.lock:
+            lines.append("# HELP %s_requests_total Requests sent to the bank website." % p)
+            lines.append("# TYPE %s_requests_total counter" % p)
+            for (endpoint, method, status), n in sorted(self.requests.items(), key=str):
+                lines.append('%s_requests_total{endpoint="%s",method="%s",status="%s"} %s'
+                             % (p, escape(endpoint), escape(method), escape(status), n))
+
+            for name, help_text, values in [("request_retries_total", "Retried attempts.", self.retries),
+                                            ("response_bytes_total", "Bytes of the response bodies.", self.bytes),
+                                            ("cache_hits_total", "Responses served from the cache.", self.cache_hits)]:
+                lines.append("# HELP %s_%s %s" % (p, name, help_text))
+                lines.append("# TYPE %s_%s counter" % (p, name))
+                for endpoint, n in sorted(values.items()):
+                    lines.append('%s_%s{endpoint="%s"} %s' % (p, name, escape(endpoint), n))
+
+            for name, help_text, histograms in [("request_duration_seconds", "Latency of the requests.", self.latency),
+                                                ("response_size_bytes", "Size of the response bodies.", self.sizes)]:
+                lines.append("# HELP %s_%s %s" % (p, name, help_text))
+                lines.append("# TYPE %s_%s histogram" % (p, name))
+                for endpoint, h in sorted(histograms.items()):
+                    label = escape(endpoint)
+                    for bound, n in zip(h.buckets, h.counts):
+                        lines.append('%s_%s_bucket{endpoint="%s",le="%s"} %s' % (p, name, label, bound, n))
+                    lines.append('%s_%s_bucket{endpoint="%s",le="+Inf"} %s' % (p, name, label, h.count))
+                    lines.append('%s_%s_sum{endpoint="%s"} %s' % (p, name, label, h.sum))
+                    lines.append('%s_%s_count{endpoint="%s"} %s' % (p, name, label, h.count))
+        return "\n".join(lines) + "\n"
@@ -1,8 +1,90 @@
 
 import requests
+import io
+import itertools
 import json
+import sys
 import time
-from datetime import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from creditagricole_particuliers import export
+
+# date format of the operations, e.g. "May 12, 2023, 12:00:00 AM"
+DATE_FORMATS = ["%b %d, %Y, %I:%M:%S %p", "%b %d, %Y %I:%M:%S %p"]
+MONTHS = {m: i + 1 for i, m in enumerate(["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                                          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])}
+
+# operations per page requested by the bank website
+DEFAULT_LIMIT = 30
+MAX_LIMIT = 1000
+# page sizes tried from the largest with limit="auto"
+PAGE_SIZES = [500, 200, 100, 50, 30]
+# responses rejecting a page size, any other error is raised at once
+PAGE_REJECTED_STATUS = [400, 413, 422]
+# largest page size accepted by each regional bank, found by the probes
+PAGE_LIMITS = {}
+
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    """parse a date of the operations, the same dates come back for many operations and are cached"""
+    try:
+        # split the fixed format by hand, strptime is much slower
+        month, day, year, hms, meridiem = value.replace(",", " ").split()
+        hour, minute, second = hms.split(":")
+        hour = int(hour) % 12 + (12 if meridiem == "PM" else 0)
+        return datetime(int(year), MONTHS[month], int(day), hour, int(minute), int(second))
+    except (ValueError, KeyError):
+        pass
+
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise Exception( "[error] unknown date format: %s" % value )
+
+def as_datetime(value):
+    """datetime from a datetime or a "YYYY-MM-DD" date"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def format_date(value):
+    """format a date like the operations"""
+    return f"{value:%b} {value.day}, {value:%Y, %I:%M:%S %p}"
+
+def operation_id(op):
+    """fitid of the operation, or its content when the fitid is missing"""
+    if op.descr.get("fitid"):
+        return op.descr["fitid"]
+    return "%s|%s|%s" % (op.dateOp, op.libelleOp, op.montantOp)
+
+def check_limit(limit):
+    """validate a page size, "auto" probes the largest page accepted by the regional bank"""
+    if limit == "auto":
+        return limit
+    if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= MAX_LIMIT:
+        raise Exception( "[error] page size must be \"auto\" or an integer between 1 and %s: %r" % (MAX_LIMIT, limit) )
+    return limit
+
+def split_date_range(date_start, date_stop, days):
+    """split a date range into windows of days, most recent first
+
+    consecutive windows share their boundary day, its operations are deduplicated when merged
+    """
+    start = datetime.strptime(date_start, "%Y-%m-%d")
+    stop = datetime.strptime(date_stop, "%Y-%m-%d")
+    windows = []
+    while stop > start:
+        window_start = max(start, stop - timedelta(days=days))
+        windows.append((window_start.strftime("%Y-%m-%d"), stop.strftime("%Y-%m-%d")))
+        stop = window_start
+    return windows or [(date_start, date_stop)]
 
 class Operation:
     def __init__(self, descr):
@@ -12,6 +94,18 @@ class Operation:
         self.dateOp = descr["dateOperation"]
         self.montantOp = descr["montant"]
 
+    @property
+    def dateOperation(self):
+        """date of the operation as datetime"""
+        return parse_date(self.dateOp)
+
+    @property
+    def dateValeur(self):
+        """value date as datetime, None when missing"""
+        if not self.descr.get("dateValeur"):
+            return None
+        return parse_date(self.descr["dateValeur"])
+
     def __str__(self):
         """stre representation"""
         return f"Operation[date={self.dateOp}, libellé={self.libelleOp}, montant={self.montantOp}]"
@@ -20,19 +114,129 @@ class Operation:
         """return as json"""
         return json.dumps(self.descr)
 
+class CompactOperation:
+    __slots__ = ("dateOperation", "dateValeur", "libelleOp", "montantOp", "libelleTypeOperation",
+                 "codeTypeOperation", "idDevise", "pictogrammeCSS", "libelleComplementaire", "fitid")
+
+    def __init__(self, descr):
+        """operation with parsed, typed fields and without the raw description"""
+        self.dateOperation = parse_date(descr["dateOperation"])
+        self.dateValeur = parse_date(descr["dateValeur"]) if descr.get("dateValeur") else None
+        self.libelleOp = descr["libelleOperation"]
+        self.montantOp = float(descr["montant"])
+        self.libelleTypeOperation = sys.intern(descr.get("libelleTypeOperation", ""))
+        self.codeTypeOperation = sys.intern(descr.get("codeTypeOperation", ""))
+        self.idDevise = sys.intern(descr.get("idDevise", ""))
+        self.pictogrammeCSS = sys.intern(descr.get("pictogrammeCSS", ""))
+        self.libelleComplementaire = descr.get("libelleComplementaire", "")
+        self.fitid = descr.get("fitid", "")
+
+    @property
+    def dateOp(self):
+        """date as returned by the api"""
+        return format_date(self.dateOperation)
+
+    @property
+    def descr(self):
+        """description rebuilt from the kept fields"""
+        return {"dateOperation": self.dateOp,
+                "dateValeur": format_date(self.dateValeur) if self.dateValeur else "",
+                "libelleOperation": self.libelleOp,
+                "montant": self.montantOp,
+                "libelleTypeOperation": self.libelleTypeOperation,
+                "codeTypeOperation": self.codeTypeOperation,
+                "idDevise": self.idDevise,
+                "pictogrammeCSS": self.pictogrammeCSS,
+                "libelleComplementaire": self.libelleComplementaire,
+                "fitid": self.fitid}
+
+    def __str__(self):
+        """stre representation"""
+        return f"Operation[date={self.dateOp}, libellé={self.libelleOp}, montant={self.montantOp}]"
+
+    def as_json(self):
+        """return as json"""
+        return json.dumps(self.descr)
+
+class OperationsColumns:
+    def __init__(self, descrs=()):
+        """columnar storage of operations, repeated strings are stored once and referenced by code"""
+        self.dates = array("q")
+        self.montants = array("d")
+        self.types = array("I")
+        self.devises = array("I")
+        self.pictogrammes = array("I")
+        self.libelles = []
+        self.fitids = []
+        self.strings = []
+        self.codes = {}
+
+        self.extend(descrs)
+
+    def __len__(self):
+        """number of operations"""
+        return len(self.dates)
+
+    def __iter__(self):
+        """iterate over the rows"""
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def code(self, value):
+        """code of a repeated string"""
+        if value not in self.codes:
+            self.codes[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+        return self.codes[value]
+
+    def append(self, descr):
+        """add an operation from its description"""
+        self.dates.append(int(parse_date(descr["dateOperation"]).timestamp()))
+        self.montants.append(float(descr["montant"]))
+        self.types.append(self.code(descr.get("libelleTypeOperation", "")))
+        self.devises.append(self.code(descr.get("idDevise", "")))
+        self.pictogrammes.append(self.code(descr.get("pictogrammeCSS", "")))
+        self.libelles.append(descr["libelleOperation"])
+        self.fitids.append(descr.get("fitid", ""))
+
+    def extend(self, descrs):
+        """add operations from their descriptions"""
+        for descr in descrs:
+            self.append(descr)
+
+    def row(self, i):
+        """operation at index i as a dict"""
+        return {"dateOperation": datetime.fromtimestamp(self.dates[i]),
+                "montant": self.montants[i],
+                "libelleTypeOperation": self.strings[self.types[i]],
+                "idDevise": self.strings[self.devises[i]],
+                "pictogrammeCSS": self.strings[self.pictogrammes[i]],
+                "libelleOperation": self.libelles[i],
+                "fitid": self.fitids[i]}
+
 class DeferredOperations:
-    def __init__(self, session, compteIdx, grandeFamilleCode, carteIdx):
-        """deferred card operations"""
+    def __init__(self, session, compteIdx, grandeFamilleCode, carteIdx, lazy=False):
+        """deferred card operations, with lazy=True they are fetched on first access"""
         self.session = session
         self.compteIdx = compteIdx
         self.grandeFamilleCode = grandeFamilleCode
         self.carteIdx = carteIdx
         self.list_operations = []
+        self.loaded = False
 
-        self.get_operations()
+        if not lazy:
+            self.load()
+
+    def load(self):
+        """fetch the operations on first access"""
+        if not self.loaded:
+            self.get_operations()
+            self.loaded = True
+        return self
 
     def __iter__(self):
         """iter"""
+        self.load()
         self.n = 0
         return self
         
@@ -47,19 +251,27 @@ class DeferredOperations:
 
     def as_json(self):
         """as json"""
-        _ops = []
-        for o in self.list_operations:
-            _ops.append(o.descr)
-        return json.dumps(_ops)
+        self.load()
+        fp = io.StringIO()
+        export.write_json(self.list_operations, fp, backend="json")
+        return fp.getvalue()
+
+    def export(self, fp, fmt="ndjson", **kwargs):
+        """write the operations to a file-like object, see export.write"""
+        return export.write(self.load().list_operations, fp, fmt, **kwargs)
         
-    def get_operations(self):
-        """get operations"""
-        # call operations
+    def build_url(self):
+        """build url of the deferred operations"""
         url = "%s" % self.session.url
         url += "/%s/particulier/operations/synthese/detail-comptes/" % self.session.regional_bank_url
         url += "jcr:content.n3.operations.encours.carte.debit.differe.json"
         url += "?grandeFamilleCode=%s&compteIdx=%s&carteIdx=%s" % (self.grandeFamilleCode, self.compteIdx, self.carteIdx)
-        r = requests.get(url=url, verify=self.session.ssl_verify, cookies=self.session.cookies)
+        return url
+
+    def get_operations(self):
+        """get operations"""
+        # call operations
+        r = self.session.get(url=self.build_url(), endpoint="n3.operations.encours.carte")
         if r.status_code != 200:
             raise Exception( "[error] get deffered operations: %s - %s" % (r.status_code, r.text) )
            
@@ -68,19 +280,49 @@ class DeferredOperations:
             self.list_operations.append( Operation(op) )
 
 class Operations:
-    def __init__(self, session, compteIdx, grandeFamilleCode, date_start, date_stop, count=100, sleep=None):
-        """operations class"""
+    def __init__(self, session, compteIdx, grandeFamilleCode, date_start, date_stop, count=100, sleep=None, stream=False, lazy=False,
+                 compact=False, shard_days=None, max_workers=4, limit=DEFAULT_LIMIT, exact=False):
+        """operations class, with stream=True the pages are fetched while iterating,
+        with lazy=True they are fetched and kept on first access,
+        with compact=True the operations are CompactOperation records,
+        with shard_days the date range is split into windows of shard_days fetched by max_workers threads,
+        limit is the page size, "auto" for the largest page accepted by the regional bank,
+        with exact=True no more than count operations are requested and kept"""
         self.session = session
         self.compteIdx = compteIdx
         self.grandeFamilleCode = grandeFamilleCode
         self.date_start = date_start
         self.date_stop = date_stop
+        self.count = count
+        self.sleep = sleep
+        self.stream = stream
+        self.compact = compact
+        self.shard_days = shard_days
+        self.max_workers = max_workers
+        self.limit = check_limit(limit)
+        self.exact = exact
         self.list_operations = []
+        self.index = None
+        self.loaded = False
         
-        self.get_operations(count=count, sleep=sleep)
+        if not stream and not lazy:
+            self.load()
+
+    def load(self):
+        """fetch the operations on first access"""
+        if not self.loaded:
+            if self.shard_days:
+                self.get_sharded_operations(count=self.count, sleep=self.sleep)
+            else:
+                self.get_operations(count=self.count, sleep=self.sleep)
+            self.loaded = True
+        return self
 
     def __iter__(self):
         """iter"""
+        if self.stream:
+            return self.iter_operations(count=self.count, sleep=self.sleep)
+        self.load()
         self.n = 0
         return self
         
@@ -95,13 +337,55 @@ class Operations:
 
     def as_json(self):
         """as json"""
-        _ops = []
-        for o in self.list_operations:
-            _ops.append(o.descr)
-        return json.dumps(_ops)
+        self.load()
+        fp = io.StringIO()
+        export.write_json(self.list_operations, fp, backend="json")
+        return fp.getvalue()
 
-    def get_operations(self, count, startIndex=None, limit=30, sleep=None):
-        """get operations according to the date range"""
+    def export(self, fp, fmt="ndjson", **kwargs):
+        """write the operations to a file-like object, see export.write
+
+        with stream=True each page is written as it arrives and nothing is kept
+        """
+        if self.stream:
+            ops = self.iter_operations(count=self.count, sleep=self.sleep)
+        else:
+            ops = self.load().list_operations
+        return export.write(ops, fp, fmt, **kwargs)
+
+    def date_index(self):
+        """(dates, operations) sorted by date, rebuilt when operations were added"""
+        self.load()
+        if self.index is None or len(self.index[1]) != len(self.list_operations):
+            ops = sorted(self.list_operations, key=lambda o: o.dateOperation)
+            self.index = ([o.dateOperation for o in ops], ops)
+        return self.index
+
+    def between(self, start, end):
+        """operations from start to end included, oldest first
+
+        start and end are datetimes or "YYYY-MM-DD" dates, a date end includes the whole day
+        """
+        dates, ops = self.date_index()
+        lo = bisect_left(dates, as_datetime(start))
+        if isinstance(end, datetime):
+            hi = bisect_right(dates, end)
+        else:
+            hi = bisect_left(dates, as_datetime(end) + timedelta(days=1))
+        return ops[lo:hi]
+
+    def latest(self, n):
+        """n most recent operations, most recent first"""
+        dates, ops = self.date_index()
+        return ops[max(0, len(ops) - n):][::-1]
+
+    def as_columns(self):
+        """operations in a columnar container"""
+        self.load()
+        return OperationsColumns([o.descr for o in self.list_operations])
+
+    def build_url(self, startIndex=None, limit=DEFAULT_LIMIT):
+        """build url of one page of operations"""
         # convert date to timestamp
         ts_date_debut = datetime.strptime(self.date_start, "%Y-%m-%d")
         ts_date_debut = int(ts_date_debut.timestamp())*1000
@@ -109,12 +393,6 @@ class Operations:
         ts_date_fin = datetime.strptime(self.date_stop, "%Y-%m-%d")
         ts_date_fin = int(ts_date_fin.timestamp())*1000
 
-        # limit operations to 30
-        nextCount = 0
-        if count > limit:
-            nextCount = count - limit
-        
-        # call operations ressources
         url = "%s" % self.session.url
         url += "/%s/particulier/operations/synthese/detail-comptes/" % self.session.regional_bank_url
         url += "jcr:content.n3.operations.json?grandeFamilleCode=%s&compteIdx=%s" % (self.grandeFamilleCode, self.compteIdx)
@@ -125,17 +403,132 @@ class Operations:
         else:
             url += "&dateFin=%s" % ts_date_fin
         url += "&count=%s" % limit
-        
-        r = requests.get(url=url, verify=self.session.ssl_verify, cookies=self.session.cookies)
+        return url
+
+    def page_limit(self, limit=None):
+        """page size to request, "auto" when the regional bank has not been probed yet"""
+        limit = check_limit(self.limit if limit is None else limit)
+        if limit == "auto":
+            return PAGE_LIMITS.get(self.session.regional_bank_url, "auto")
+        return limit
+
+    def get_page(self, startIndex=None, limit=DEFAULT_LIMIT):
+        """fetch one page of operations"""
+        r = self.session.get(url=self.build_url(startIndex=startIndex, limit=limit), endpoint="n3.operations")
         if r.status_code != 200:
             raise Exception( "[error] get operations: %s - %s" % (r.status_code, r.text) )
-           
-        # success, save list operations
-        rsp = json.loads(r.text)
-        for op in rsp["listeOperations"]:
-            self.list_operations.append( Operation(op) )
+        return json.loads(r.text)
+
+    def probe_page(self, startIndex=None):
+        """fetch one page with the largest page size accepted, return (page, page size)
+
+        the page size is kept for the regional bank, rejected sizes cost one request each,
+        other errors such as an expired session (401, 403) are raised without trying smaller pages
+        """
+        for limit in PAGE_SIZES:
+            r = self.session.get(url=self.build_url(startIndex=startIndex, limit=limit), endpoint="n3.operations")
+            if r.status_code in PAGE_REJECTED_STATUS and limit != PAGE_SIZES[-1]:
+                continue
+            if r.status_code != 200:
+                raise Exception( "[error] get operations: %s - %s" % (r.status_code, r.text) )
+
+            rsp = json.loads(r.text)
+            # a server capping the page size returns fewer operations and a next page
+            if rsp.get("hasNext") is True and 0 < len(rsp["listeOperations"]) < limit:
+                limit = len(rsp["listeOperations"])
+            PAGE_LIMITS[self.session.regional_bank_url] = limit
+            return rsp, limit
+
+    def iter_pages(self, count, startIndex=None, limit=None, sleep=None):
+        """yield the operations page by page, count=None fetches every page
+
+        limit defaults to the page size of the operations, count is rounded up to whole pages unless exact
+        """
+        limit = self.page_limit(limit)
+        operation = CompactOperation if self.compact else Operation
+        while True:
+            # call operations ressources
+            if limit == "auto":
+                rsp, limit = self.probe_page(startIndex=startIndex)
+            elif self.exact and count is not None:
+                rsp = self.get_page(startIndex=startIndex, limit=min(limit, count))
+            else:
+                rsp = self.get_page(startIndex=startIndex, limit=limit)
+
+            ops = rsp["listeOperations"]
+            if self.exact and count is not None:
+                ops = ops[:count]
+            yield [operation(op) for op in ops]
 
-        if nextCount > 0 and 'nextSetStartIndex' in rsp and 'hasNext' in rsp and rsp['hasNext'] is True:
+            # whole pages until count is reached
+            if count is not None:
+                count -= len(ops) if self.exact else limit
+                if count <= 0:
+                    return
+            if 'nextSetStartIndex' not in rsp or rsp.get('hasNext') is not True:
+                return
+
+            startIndex = rsp["nextSetStartIndex"]
             if sleep is not None and (isinstance(sleep, int) or isinstance(sleep, float)):
                 time.sleep(sleep)
-            self.get_operations(nextCount, rsp["nextSetStartIndex"])
+
+    def iter_operations(self, count, startIndex=None, limit=None, sleep=None):
+        """yield the operations as each page arrives"""
+        for page in self.iter_pages(count=count, startIndex=startIndex, limit=limit, sleep=sleep):
+            yield from page
+
+    def get_operations(self, count, startIndex=None, limit=None, sleep=None):
+        """get operations according to the date range"""
+        # success, save list operations
+        for page in self.iter_pages(count=count, startIndex=startIndex, limit=limit, sleep=sleep):
+            self.list_operations.extend(page)
+
+    def get_sharded_operations(self, count, sleep=None):
+        """get operations window by window in parallel, merged most recent first
+
+        with count, no more windows are scheduled once count operations are merged
+        """
+        def fetch(window, needed):
+            ops = Operations(session=self.session,
+                             compteIdx=self.compteIdx,
+                             grandeFamilleCode=self.grandeFamilleCode,
+                             date_start=window[0],
+                             date_stop=window[1],
+                             stream=True, compact=self.compact, limit=self.limit, exact=self.exact)
+            return list(ops.iter_operations(count=needed, sleep=sleep))
+
+        def needed():
+            return None if count is None else count - len(self.list_operations)
+
+        windows = iter(split_date_range(self.date_start, self.date_stop, self.shard_days))
+        # ids of the operations of the day shared with the next window, counted as identical operations
+        # without fitid can occur more than once
+        boundary_day, boundary = None, {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # windows in flight, consumed in order, the most recent first
+            futures = deque((window, executor.submit(fetch, window, needed()))
+                            for window in itertools.islice(windows, self.max_workers))
+            while futures:
+                window, future = futures.popleft()
+                shared = {}
+                for op in future.result():
+                    day = op.dateOperation.strftime("%Y-%m-%d")
+                    op_id = operation_id(op)
+                    # the boundary day is returned by both windows
+                    if day == boundary_day and boundary.get(op_id):
+                        boundary[op_id] -= 1
+                        continue
+                    if day == window[0]:
+                        shared[op_id] = shared.get(op_id, 0) + 1
+                    self.list_operations.append(op)
+                boundary_day, boundary = window[0], shared
+
+                if count is not None and len(self.list_operations) >= count:
+                    for _, pending in futures:
+                        pending.cancel()
+                    break
+                window = next(windows, None)
+                if window is not None:
+                    futures.append((window, executor.submit(fetch, window, needed())))
+        if count is not None:
+            del self.list_operations[count:]
@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from creditagricole_particuliers import authenticator
+from creditagricole_particuliers import regionalbanks
+
+# options owned by one customer, given with its credentials instead of being shared by the pool
+PER_SESSION_OPTIONS = ["session_file", "session_key", "transport", "cache"]
+
+
+class SessionPool:
+    def __init__(self, credentials, max_workers=10, per_bank=4, refresh_after=600, **options):
+        """sessions of many customers
+
+        credentials: list of {"username", "password", "department"}, with the PER_SESSION_OPTIONS of the customer if any
+        max_workers: concurrent logins and workers
+        per_bank: requests in flight per regional bank, shared by its customers
+        refresh_after: seconds after which a session is checked again before use
+        options: forwarded to every Authenticator, e.g. limiter or metrics, cache=False disables the caches
+        """
+        for name in PER_SESSION_OPTIONS:
+            if name in options and not (name == "cache" and options[name] is False):
+                raise Exception("[error] %s is per customer, give it with the credentials of each customer" % name)
+
+        self.credentials = {c["username"]: c for c in credentials}
+        self.max_workers = max_workers
+        self.per_bank = per_bank
+        self.refresh_after = refresh_after
+        self.options = options
+        self.sessions = {}
+        self.checked = {}
+        self.errors = {}
+        self.limits = {}
+        self.lock = threading.Lock()
+        # one login at a time per customer
+        self.logins = {username: threading.RLock() for username in self.credentials}
+
+    def __iter__(self):
+        """iter over the ready sessions"""
+        return iter(list(self.sessions.values()))
+
+    def limit(self, department):
+        """semaphore shared by the customers of a regional bank"""
+        bank = regionalbanks.find_alias(department)
+        with self.lock:
+            if bank not in self.limits:
+                self.limits[bank] = threading.BoundedSemaphore(self.per_bank)
+            return self.limits[bank]
+
+    def login(self, username):
+        """login one customer"""
+        c = self.credentials[username]
+        options = dict(self.options)
+        options.update({name: c[name] for name in PER_SESSION_OPTIONS if name in c})
+        with self.logins[username]:
+            session = authenticator.Authenticator(username=c["username"],
+                                                  password=c["password"],
+                                                  department=c["department"],
+                                                  semaphore=self.limit(c["department"]),
+                                                  **options)
+            with self.lock:
+                self.sessions[username] = session
+                self.checked[username] = time.monotonic()
+                self.errors.pop(username, None)
+        return session
+
+    def start(self):
+        """login every customer concurrently, failures are kept in errors"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.get, username): username for username in self.credentials}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    self.errors[futures[future]] = future.exception()
+        return self
+
+    def refresh(self, username):
+        """login again a customer"""
+        session = self.sessions.get(username)
+        if session is not None:
+            session.close()
+        return self.login(username)
+
+    def get(self, username):
+        """ready session of a customer, checked when older than refresh_after"""
+        with self.logins[username]:
+            session = self.sessions.get(username)
+            if session is None:
+                return self.login(username)
+
+            if time.monotonic() - self.checked[username] > self.refresh_after:
+                if not session.check_session():
+                    return self.refresh(username)
+                self.checked[username] = time.monotonic()
+            return session
+
+    def map(self, func):
+        """call func(session) for every customer with bounded parallelism, yield (username, result)"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(lambda u: func(self.get(u)), username): username
+                       for username in self.credentials if username not in self.errors}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def close(self):
+        """release the connections of every session"""
+        for session in self.sessions.values():
+            session.close()
@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+import time
+
+from urllib3 import connection
+
+from creditagricole_particuliers import accounts
+from creditagricole_particuliers import authenticator
+from creditagricole_particuliers import cards
+from creditagricole_particuliers import export
+from creditagricole_particuliers import iban
+from creditagricole_particuliers import logout
+from creditagricole_particuliers import operations
+from creditagricole_particuliers import ratelimit
+from creditagricole_particuliers import regionalbanks
+
+PHASES = ["connect", "tls", "transfer", "decode", "model", "serialize", "sleep"]
+
+# modules whose json and time functions are timed while profiling
+JSON_MODULES = [accounts, authenticator, cards, export, iban, logout, operations, regionalbanks]
+SLEEP_MODULES = [operations, ratelimit]
+MODEL_CLASSES = [operations.Operation, operations.CompactOperation, accounts.Account, cards.Card]
+EXPORT_WRITERS = ["write_ndjson", "write_json", "write_csv", "write_parquet", "write_arrow"]
+
+
+class Proxy:
+    def __init__(self, module, **functions):
+        """module with some functions replaced"""
+        self.module = module
+        self.__dict__.update(functions)
+
+    def __getattr__(self, name):
+        """other attributes of the module"""
+        return getattr(self.module, name)
+
+
+# hooks shared by the active profilers, installed by the first one and removed by the last one
+HOOKS = {"profilers": 0, "patches": []}
+HOOKS_LOCK = threading.Lock()
+
+
+def current_profiler():
+    """active profiler of the session that last sent a request on this thread, None when not profiling"""
+    profiler = getattr(authenticator.PROFILER_CONTEXT, "profiler", None)
+    if profiler is None or not profiler.active:
+        return None
+    return profiler
+
+
+def hook(name, func, nested=False):
+    """func timed as a phase by the profiler of the current thread
+
+    nested: only timed inside another span, e.g. the connections opened by a profiled transfer
+    """
+    def timed(*args, **kwargs):
+        profiler = current_profiler()
+        if profiler is None or (nested and not profiler.stack()):
+            return func(*args, **kwargs)
+        return profiler.call(name, func, *args, **kwargs)
+    return timed
+
+
+def patch(target, name, value):
+    """replace an attribute until remove_hooks"""
+    HOOKS["patches"].append((target, name, target.__dict__.get(name, None), name in target.__dict__))
+    setattr(target, name, value)
+
+
+def install_hooks():
+    """time the phases, the hooks are shared by all the profilers"""
+    with HOOKS_LOCK:
+        HOOKS["profilers"] += 1
+        if HOOKS["profilers"] > 1:
+            return
+
+        patch(connection.HTTPConnection, "_new_conn", hook("connect", connection.HTTPConnection._new_conn, nested=True))
+        patch(connection.HTTPSConnection, "connect", hook("tls", connection.HTTPSConnection.connect, nested=True))
+        for module in JSON_MODULES:
+            patch(module, "json", Proxy(json, loads=hook("decode", json.loads), dumps=hook("serialize", json.dumps)))
+        for name in EXPORT_WRITERS:
+            patch(export, name, hook("serialize", getattr(export, name)))
+        for module in SLEEP_MODULES:
+            patch(module, "time", Proxy(time, sleep=hook("sleep", time.sleep)))
+        for cls in MODEL_CLASSES:
+            patch(cls, "__init__", hook("model", cls.__init__))
+
+
+def remove_hooks():
+    """restore the patched attributes once the last profiler exits"""
+    with HOOKS_LOCK:
+        HOOKS["profilers"] -= 1
+        if HOOKS["profilers"] > 0:
+            return
+
+        while HOOKS["patches"]:
+            target, name, value, owned = HOOKS["patches"].pop()
+            if owned:
+                setattr(target, name, value)
+            else:
+                delattr(target, name)
+
+
+class Profiler:
+    def __init__(self, session, trace_file=None, min_trace_us=20):
+        """wall and cpu time per phase of the run of a session, use `with Profiler(session) as p:`
+
+        phases: connect (tcp), tls (handshake), transfer (request and response), decode (json.loads),
+        model (Operation, CompactOperation, Account and Card objects), serialize (json.dumps, exporters), sleep
+        the time of a phase excludes the phases nested in it, e.g. transfer excludes connect and tls
+        a thread works for the session once it sends a request of the session, or once it enters the profiler,
+        until it sends a request of another session
+        trace_file: chrome trace event file written on exit, viewable in chrome://tracing or Perfetto
+        min_trace_us: shorter spans are counted in the summary but left out of the trace
+        """
+        self.session = session
+        self.trace_file = trace_file
+        self.min_trace_us = min_trace_us
+        self.stats = {}
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.active = False
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __enter__(self):
+        """start profiling the session"""
+        with HOOKS_LOCK:
+            if getattr(self.session, "profiler", None) is not None:
+                raise Exception("[error] a profiler is already active on this session")
+            self.session.profiler = self
+        self.previous = getattr(authenticator.PROFILER_CONTEXT, "profiler", None)
+        authenticator.PROFILER_CONTEXT.profiler = self
+
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.active = True
+        install_hooks()
+        return self
+
+    def __exit__(self, *exc):
+        """stop profiling and write the trace file"""
+        self.active = False
+        remove_hooks()
+        self.session.profiler = None
+        authenticator.PROFILER_CONTEXT.profiler = self.previous
+
+        self.wall = time.perf_counter() - self.start_wall
+        self.cpu = time.process_time() - self.start_cpu
+        self.add_event("run", self.start_wall, self.wall, threading.get_ident())
+        if self.trace_file is not None:
+            self.write_trace(self.trace_file)
+        return False
+
+    def call(self, name, func, *args, **kwargs):
+        """call func timed as a phase"""
+        stack = self.stack()
+        frame = [0.0, 0.0]
+        stack.append(frame)
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            self.add(name, wall - frame[0], cpu - frame[1], start_wall, wall)
+
+    def stack(self):
+        """open spans of the current thread"""
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def add(self, name, wall, cpu, start, duration):
+        """count the exclusive time of a span"""
+        with self.lock:
+            s = self.stats.setdefault(name, {"count": 0, "wall": 0.0, "cpu": 0.0})
+            s["count"] += 1
+            s["wall"] += wall
+            s["cpu"] += cpu
+        if duration * 1e6 >= self.min_trace_us:
+            self.add_event(name, start, duration, threading.get_ident())
+
+    def add_event(self, name, start, duration, tid):
+        """chrome trace complete event"""
+        with self.lock:
+            self.events.append({"name": name, "cat": "creditagricole", "ph": "X",
+                                "ts": round((start - self.start_wall) * 1e6, 3),
+                                "dur": round(duration * 1e6, 3),
+                                "pid": os.getpid(), "tid": tid})
+
+    def report(self):
+        """wall and cpu seconds per phase, with the share of the run wall time"""
+        phases = {}
+        for name in PHASES + sorted(set(self.stats) - set(PHASES)):
+            s = self.stats.get(name, {"count": 0, "wall": 0.0, "cpu": 0.0})
+            phases[name] = {"count": s["count"],
+                            "wall": round(s["wall"], 6),
+                            "cpu": round(s["cpu"], 6),
+                            "share": round(s["wall"] / self.wall, 4) if self.wall else 0.0}
+        other = max(0.0, self.wall - sum(s["wall"] for s in self.stats.values()))
+        return {"wall": round(self.wall, 6), "cpu": round(self.cpu, 6), "other": round(other, 6), "phases": phases}
+
+    def format_report(self):
+        """report as a text table"""
+        r = self.report()
+        lines = ["%-10s %8s %12s %12s %8s" % ("phase", "count", "wall ms", "cpu ms", "share")]
+        for name, p in r["phases"].items():
+            lines.append("%-10s %8s %12.3f %12.3f %7.1f%%" % (name, p["count"], p["wall"] * 1000, p["cpu"] * 1000,
+                                                            p["share"] * 100))
+        lines.append("%-10s %8s %12.3f %12s" % ("other", "", r["other"] * 1000, ""))
+        lines.append("%-10s %8s %12.3f %12.3f" % ("run", "", r["wall"] * 1000, r["cpu"] * 1000))
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """write the spans in the chrome trace event format"""
+        with self.lock:
+            events = sorted(self.events, key=lambda e: e["ts"])
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
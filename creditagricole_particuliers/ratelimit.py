@@ -0,0 +1,82 @@
+import random
+import threading
+import time
+
+# responses slowing down the limiter, 5xx are retried for GET requests only
+THROTTLE_STATUS = [429, 500, 502, 503, 504]
+
+
+class RateLimiter:
+    def __init__(self, rate=5.0, burst=5, min_rate=0.5, increase=1.0, retries=5, backoff=0.5, max_backoff=30):
+        """adaptive token bucket shared by the sessions
+
+        rate: requests per second allowed, the limiter never goes above it
+        burst: requests allowed at once
+        min_rate: lowest rate after back off
+        increase: requests per second given back after each healthy response
+        retries: attempts after a 429 or 5xx response
+        backoff, max_backoff: bounds of the jittered exponential delay between attempts
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase = increase
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.throttled = 0
+
+    def acquire(self):
+        """wait for a token"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self):
+        """healthy response, speed back up"""
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def slow_down(self):
+        """throttled response, halve the rate"""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.throttled += 1
+
+    def delay(self, attempt, response=None):
+        """seconds to wait before the next attempt, Retry-After when provided"""
+        headers = getattr(response, "headers", None) or {}
+        if "Retry-After" in headers:
+            try:
+                return min(self.max_backoff, float(headers["Retry-After"]))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def send(self, method, func):
+        """call func() under the limiter, retry throttled responses"""
+        attempt = 0
+        while True:
+            self.acquire()
+            r = func()
+            if r.status_code not in THROTTLE_STATUS:
+                self.success()
+                return r
+
+            self.slow_down()
+            retry = r.status_code == 429 or method == "GET"
+            if not retry or attempt >= self.retries:
+                return r
+            time.sleep(self.delay(attempt, r))
+            attempt += 1
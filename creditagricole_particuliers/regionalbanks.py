@@ -1,21 +1,68 @@
 from urllib import parse
-import requests
+import functools
 import json
+import os
+import threading
+
+from creditagricole_particuliers import transport as transports
+
+ALIASES_PATH = os.path.join(os.path.dirname(__file__), "aliases.json")
+
+# regional banks already returned by the website, per two digits department
+BY_DEPARTEMENT = {}
+
+# connection pool of the lookups made without a session or a transport, created on first use
+DEFAULT_TRANSPORT = None
+DEFAULT_TRANSPORT_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def load_aliases():
+    """department to regional bank alias, read from aliases.json once per process"""
+    with open(ALIASES_PATH, "r") as f:
+        aliases = json.load(f)
+    return {department: descr["alias"] for department, descr in aliases.items()}
+
+def find_alias(department):
+    """regional bank alias of a department"""
+    return load_aliases()[department_key(department)]
+
+def department_key(department):
+    """two digits department, 57 and "57" share one entry"""
+    return str(department).zfill(2)
+
+def default_transport():
+    """transport shared by the RegionalBanks created without a session or a transport"""
+    global DEFAULT_TRANSPORT
+    with DEFAULT_TRANSPORT_LOCK:
+        if DEFAULT_TRANSPORT is None:
+            DEFAULT_TRANSPORT = transports.HttpTransport()
+        return DEFAULT_TRANSPORT
 
 class RegionalBanks:
-    def __init__(self):
-        """regional banks"""
+    def __init__(self, transport=None, session=None):
+        """regional banks, with session the lookup goes through the session request path
+        (rate limiter, metrics, semaphore)"""
         self.url = "https://www.credit-agricole.fr"
         self.ssl_verify = True
+        self.session = session
+        self.transport = transport or (session.transport if session is not None else default_transport())
+
+    def post(self, url, **kwargs):
+        """post request through the session when set"""
+        if self.session is not None:
+            return self.session.post(url, endpoint="get-cr-by-department", **kwargs)
+        return self.transport.request("POST", url=url, verify=self.ssl_verify, **kwargs)
 
     def by_departement(self, department):
+        """regional bank of a department, cached per process"""
+        key = department_key(department)
+        if key in BY_DEPARTEMENT:
+            return BY_DEPARTEMENT[key]
+
         url = "%s/particulier/acces-cr.get-cr-by-department.json" % (self.url)
         headers={'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
         payload = {'department': "%s" % department}
-        r = requests.post(url=url, 
-                          data=parse.urlencode(payload),
-                          headers=headers,
-                          verify=self.ssl_verify)
+        r = self.post(url, data=parse.urlencode(payload), headers=headers)
         if r.status_code != 200:
             raise Exception( "[error] get regional bank by departement: %s - %s" % (r.status_code, r.text) )
 
@@ -23,4 +70,5 @@ class RegionalBanks:
         if not len(regionalBanks):
             raise Exception( "[error] get regional bank by departement code not found"  )
 
-        return regionalBanks[0]
\ No newline at end of file
+        BY_DEPARTEMENT[key] = regionalBanks[0]
+        return regionalBanks[0]
@@ -0,0 +1,183 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from creditagricole_particuliers import operations
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    numeroCompte TEXT NOT NULL,
+    id TEXT NOT NULL,
+    idCarte TEXT,
+    dateOperation TEXT NOT NULL,
+    libelleOperation TEXT,
+    libelleTypeOperation TEXT,
+    montant REAL,
+    descr TEXT NOT NULL,
+    PRIMARY KEY (numeroCompte, id)
+);
+CREATE INDEX IF NOT EXISTS operations_account_date ON operations (numeroCompte, dateOperation);
+CREATE INDEX IF NOT EXISTS operations_date ON operations (dateOperation);
+CREATE INDEX IF NOT EXISTS operations_type ON operations (libelleTypeOperation, dateOperation);
+CREATE INDEX IF NOT EXISTS operations_card ON operations (idCarte, dateOperation);
+CREATE TABLE IF NOT EXISTS windows (
+    numeroCompte TEXT NOT NULL,
+    date_start TEXT NOT NULL,
+    date_stop TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS windows_account ON windows (numeroCompte, date_start);
+"""
+
+# columns accepted by aggregate, "month" groups by the month of dateOperation
+GROUP_BY = {"libelleTypeOperation": "libelleTypeOperation",
+            "libelleOperation": "libelleOperation",
+            "numeroCompte": "numeroCompte",
+            "idCarte": "idCarte",
+            "month": "substr(dateOperation, 1, 7)",
+            "day": "substr(dateOperation, 1, 10)"}
+
+
+class OperationsStore:
+    def __init__(self, path=":memory:"):
+        """sqlite store of the operations, keyed by account and fitid
+
+        the date windows already fetched are kept per account, only the missing ones are requested again
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """close the database"""
+        self.db.close()
+
+    def upsert(self, numeroCompte, ops, idCarte=None):
+        """insert or replace operations of an account, return the number of operations written
+
+        operations without fitid, e.g. the card operations, are keyed by card, date, label, amount and occurrence,
+        so identical purchases of the same day are kept apart and a fetch written again replaces the same rows
+        """
+        rows = []
+        occurrences = {}
+        for op in ops:
+            descr = op.descr
+            op_id = operations.operation_id(op)
+            if not descr.get("fitid"):
+                occurrences[op_id] = occurrences.get(op_id, -1) + 1
+                op_id = "%s|%s|%s" % (idCarte or "", op_id, occurrences[op_id])
+            rows.append((numeroCompte,
+                         op_id,
+                         idCarte or descr.get("idCarte") or None,
+                         op.dateOperation.strftime("%Y-%m-%d %H:%M:%S"),
+                         descr.get("libelleOperation", ""),
+                         descr.get("libelleTypeOperation", ""),
+                         float(descr["montant"]),
+                         json.dumps(descr)))
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO operations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def windows(self, numeroCompte):
+        """date windows covered for an account, [(date_start, date_stop)] sorted"""
+        with self.lock:
+            return self.db.execute("SELECT date_start, date_stop FROM windows WHERE numeroCompte = ? ORDER BY date_start",
+                                   (numeroCompte,)).fetchall()
+
+    def add_window(self, numeroCompte, date_start, date_stop):
+        """mark a window as covered, overlapping windows are merged"""
+        merged = []
+        for start, stop in sorted(self.windows(numeroCompte) + [(date_start, date_stop)]):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+            else:
+                merged.append((start, stop))
+
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM windows WHERE numeroCompte = ?", (numeroCompte,))
+            self.db.executemany("INSERT INTO windows VALUES (?, ?, ?)", [(numeroCompte, s, e) for s, e in merged])
+
+    def missing_windows(self, numeroCompte, date_start, date_stop):
+        """windows of date_start to date_stop not covered yet, boundary days are fetched again"""
+        missing = []
+        covered = False
+        for start, stop in self.windows(numeroCompte):
+            if stop < date_start or start > date_stop:
+                continue
+            if start > date_start:
+                missing.append((date_start, start))
+            date_start = max(date_start, stop)
+            covered = True
+        # a single day not covered is a window of its own
+        if date_start < date_stop or not covered:
+            missing.append((date_start, date_stop))
+        return missing
+
+    def fetch(self, account, date_start, date_stop, sleep=None, limit=operations.DEFAULT_LIMIT):
+        """fetch from the bank the windows of an account not covered yet, return the number of operations written
+
+        today is never marked as covered, its operations can still change
+        """
+        written = 0
+        yesterday = (datetime.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+        for start, stop in self.missing_windows(account.numeroCompte, date_start, date_stop):
+            ops = account.get_operations(date_start=start, date_stop=stop, count=None, sleep=sleep, limit=limit)
+            written += self.upsert(account.numeroCompte, ops.list_operations)
+            if min(stop, yesterday) >= start:
+                self.add_window(account.numeroCompte, start, min(stop, yesterday))
+        return written
+
+    def fetch_card(self, card):
+        """store the deferred operations of a card, return the number of operations written"""
+        account = card.session.accounts_index.get(card.idCompte)
+        numeroCompte = account.numeroCompte if account is not None else card.idCompte
+        return self.upsert(numeroCompte, card.get_operations().list_operations, idCarte=card.idCarte)
+
+    def where(self, numeroCompte=None, date_start=None, date_stop=None, libelleTypeOperation=None, carte=None):
+        """sql filter and parameters, carte matches the end of idCarte, e.g. its last 4 digits"""
+        clauses, params = [], []
+        if numeroCompte is not None:
+            clauses.append("numeroCompte = ?")
+            params.append(numeroCompte)
+        if date_start is not None:
+            clauses.append("dateOperation >= ?")
+            params.append(date_start)
+        if date_stop is not None:
+            # the whole day of date_stop is included
+            clauses.append("dateOperation < ?")
+            params.append((operations.as_datetime(date_stop) + timedelta(days=1)).strftime("%Y-%m-%d"))
+        if libelleTypeOperation is not None:
+            clauses.append("libelleTypeOperation = ?")
+            params.append(libelleTypeOperation)
+        if carte is not None:
+            clauses.append("idCarte LIKE ?")
+            params.append("%%%s" % carte)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, numeroCompte=None, date_start=None, date_stop=None, libelleTypeOperation=None, carte=None):
+        """stored operations matching the filters, most recent first"""
+        where, params = self.where(numeroCompte, date_start, date_stop, libelleTypeOperation, carte)
+        with self.lock:
+            rows = self.db.execute("SELECT descr FROM operations%s ORDER BY dateOperation DESC" % where, params).fetchall()
+        return [operations.Operation(json.loads(descr)) for descr, in rows]
+
+    def count(self, numeroCompte=None, date_start=None, date_stop=None, libelleTypeOperation=None, carte=None):
+        """number of stored operations matching the filters"""
+        where, params = self.where(numeroCompte, date_start, date_stop, libelleTypeOperation, carte)
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM operations%s" % where, params).fetchone()[0]
+
+    def aggregate(self, by="libelleTypeOperation", numeroCompte=None, date_start=None, date_stop=None,
+                  libelleTypeOperation=None, carte=None):
+        """sum and count of the amounts per group, {group: (sum, count)} sorted by sum
+
+        by: one of GROUP_BY, e.g. "libelleOperation" for the spend per merchant
+        """
+        if by not in GROUP_BY:
+            raise Exception( "[error] unknown group: %s, expected one of %s" % (by, ", ".join(GROUP_BY)) )
+        where, params = self.where(numeroCompte, date_start, date_stop, libelleTypeOperation, carte)
+        sql = "SELECT %s AS g, SUM(montant), COUNT(*) FROM operations%s GROUP BY g ORDER BY SUM(montant)" % (GROUP_BY[by], where)
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return {g: (round(total, 2), n) for g, total, n in rows}
@@ -0,0 +1,77 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from creditagricole_particuliers import operations
+
+
+class SyncStore:
+    def __init__(self, path):
+        """json file with the high-water mark of each account"""
+        self.path = path
+        self.marks = {}
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.marks = json.load(f)
+
+    def get(self, numeroCompte):
+        """return the mark {"last_date": "YYYY-MM-DD", "fitids": [...]} or None, fitids of the lookback window"""
+        return self.marks.get(numeroCompte)
+
+    def set(self, numeroCompte, last_date, fitids):
+        """update the mark of an account"""
+        self.marks[numeroCompte] = {"last_date": last_date, "fitids": sorted(fitids)}
+
+    def save(self):
+        """write the store atomically"""
+        tmp = "%s.tmp" % self.path
+        with open(tmp, "w") as f:
+            json.dump(self.marks, f)
+        os.replace(tmp, self.path)
+
+
+class IncrementalSync:
+    def __init__(self, path, days=30, lookback=3):
+        """fetch only the operations added since the last run
+
+        lookback: days before the mark fetched again, for the operations booked late with an earlier date,
+        e.g. deferred card debits or weekend postings
+        """
+        self.store = SyncStore(path)
+        self.days = days
+        self.lookback = lookback
+
+    def sync(self, account, sleep=None):
+        """return the new operations of the account and move its mark forward"""
+        mark = self.store.get(account.numeroCompte)
+        today = datetime.today()
+        if mark is None:
+            date_start = (today - timedelta(days=self.days)).strftime('%Y-%m-%d')
+            last_date, seen = None, set()
+        else:
+            # the lookback window is fetched again, its operations are deduplicated by fitid
+            last_date = mark["last_date"]
+            date_start = (datetime.strptime(last_date, '%Y-%m-%d') - timedelta(days=self.lookback)).strftime('%Y-%m-%d')
+            seen = set(mark["fitids"])
+
+        fetched, new_ops = [], []
+        for op in account.iter_operations(date_start=date_start,
+                                          date_stop=today.strftime('%Y-%m-%d'),
+                                          count=None, sleep=sleep):
+            fetched.append(op)
+            if operations.operation_id(op) not in seen:
+                new_ops.append(op)
+
+        # keep the ids of the lookback window before the new mark, older days are never fetched again
+        for op in new_ops:
+            day = op.dateOperation.strftime('%Y-%m-%d')
+            if last_date is None or day > last_date:
+                last_date = day
+        if last_date is not None:
+            window_start = (datetime.strptime(last_date, '%Y-%m-%d') - timedelta(days=self.lookback)).strftime('%Y-%m-%d')
+            seen = set(operations.operation_id(op) for op in fetched
+                       if op.dateOperation.strftime('%Y-%m-%d') >= window_start)
+            self.store.set(account.numeroCompte, last_date, seen)
+            self.store.save()
+        return new_ops
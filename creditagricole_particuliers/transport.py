@@ -0,0 +1,219 @@
+import json
+import os
+import re
+import time
+from datetime import timedelta
+from urllib import parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from creditagricole_particuliers import operations
+
+SAMPLES_PATH = os.path.join(os.path.dirname(__file__), "..", "samples", "data")
+
+# responses retried by the connection pool for GET requests
+RETRY_STATUS = [502, 503, 504]
+
+
+class HttpTransport:
+    def __init__(self, pool_size=10, retries=3, status_forcelist=RETRY_STATUS):
+        """keep-alive connection pool to the bank website
+
+        status_forcelist: responses retried, the last one is returned once the retries are exhausted
+        """
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=Retry(total=retries,
+                                                backoff_factor=0.5,
+                                                status_forcelist=status_forcelist,
+                                                allowed_methods=["GET"],
+                                                raise_on_status=False))
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        """send a request"""
+        return self.http.request(method=method, url=url, **kwargs)
+
+    def close(self):
+        """release pooled connections"""
+        self.http.close()
+
+
+class ReplayResponse:
+    def __init__(self, status_code, text):
+        """response served by the replay transport"""
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode()
+        self.cookies = requests.cookies.RequestsCookieJar()
+
+
+class ReplayTransport:
+    def __init__(self, path=SAMPLES_PATH, latency=0, accounts=None, operations=None, max_page=None):
+        """serve the samples/data fixtures in place of the bank website
+
+        latency: seconds slept before each response
+        accounts: number of synthetic accounts cloned from the fixtures
+        operations: number of synthetic operations per account
+        max_page: largest page of operations accepted, larger pages are rejected with a 400
+        path defaults to the samples/data directory of a source checkout, it is not installed with the package
+        """
+        if not os.path.exists(os.path.join(path, "accounts.json")):
+            raise Exception("[error] replay fixtures not found in %s, give the path of a samples/data directory" % path)
+        self.path = path
+        self.latency = latency
+        self.max_page = max_page
+        self.nb_operations = operations
+        self.requests = 0
+
+        self.accounts = self.load("accounts.json")
+        self.cards = self.load("cards.json")
+        self.sources = {acc["numeroCompte"]: acc["numeroCompte"] for acc in self.accounts}
+        if accounts is not None:
+            self.accounts = self.clone_accounts(accounts)
+        self.history = {}
+        self.windows = {}
+
+    def load(self, filename, default=None):
+        """load a fixture file"""
+        filepath = os.path.join(self.path, filename)
+        if not os.path.exists(filepath):
+            return default
+        with open(filepath, "r") as f:
+            return json.load(f)
+
+    def clone_accounts(self, count):
+        """synthetic accounts cycling over the fixtures, the fixtures themselves come first"""
+        fixtures = self.accounts
+        accounts = fixtures[:count]
+        for i in range(len(accounts), count):
+            acc = dict(fixtures[i % len(fixtures)])
+            acc["index"] = i
+            acc["numeroCompte"] = "%011d" % (10**10 + i)
+            self.sources[acc["numeroCompte"]] = fixtures[i % len(fixtures)]["numeroCompte"]
+            accounts.append(acc)
+        return accounts
+
+    def account(self, compteIdx):
+        """account by index"""
+        for acc in self.accounts:
+            if str(acc["index"]) == str(compteIdx):
+                return acc
+        return None
+
+    def operations(self, numeroCompte):
+        """operations of an account sorted by date, most recent first"""
+        if numeroCompte not in self.history:
+            ops = self.load("account_%s_operations.json" % self.sources[numeroCompte], default=[])
+            if self.nb_operations is not None and ops:
+                ops = self.generate_operations(ops, self.nb_operations)
+            ops = sorted(ops, key=lambda op: operations.parse_date(op["dateOperation"]), reverse=True)
+            self.history[numeroCompte] = [(operations.parse_date(op["dateOperation"]).timestamp() * 1000, op)
+                                          for op in ops]
+        return self.history[numeroCompte]
+
+    def generate_operations(self, fixtures, count):
+        """synthetic history, ten operations per day going back from the latest fixture"""
+        latest = max(operations.parse_date(op["dateOperation"]) for op in fixtures)
+        ops = []
+        for i in range(count):
+            op = dict(fixtures[i % len(fixtures)])
+            date = latest - timedelta(days=i // 10)
+            op["dateOperation"] = operations.format_date(date)
+            op["dateValeur"] = operations.format_date(date)
+            op["fitid"] = "%013d" % (i + 1)
+            ops.append(op)
+        return ops
+
+    def request(self, method, url, **kwargs):
+        """answer a request from the fixtures"""
+        if self.latency:
+            time.sleep(self.latency)
+        self.requests += 1
+        status_code, body = self.route(method, url, kwargs.get("data"))
+        return ReplayResponse(status_code, body if isinstance(body, str) else json.dumps(body))
+
+    def route(self, method, url, data=None):
+        """return (status, body) for an url"""
+        u = parse.urlsplit(url)
+        query = dict(parse.parse_qsl(u.query))
+        form = dict(parse.parse_qsl(data)) if isinstance(data, str) else (data or {})
+
+        if u.path.endswith("authenticationKeypad.json"):
+            return 200, {"keypadId": "replay", "keyLayout": [str(d) for d in range(10)]}
+
+        if u.path.endswith("j_security_check"):
+            return 200, {}
+
+        if u.path.endswith("get-cr-by-department.json"):
+            bank = self.load("regionalBank_%s.json" % form.get("department"))
+            return 200, [bank] if bank else []
+
+        m = re.search(r"produits-valorisation\.json/(\d+)$", u.path)
+        if m:
+            return 200, [acc for acc in self.accounts if str(acc["grandeFamilleProduitCode"]) == m.group(1)]
+
+        if u.path.endswith("n3.operations.json"):
+            acc = self.account(query.get("compteIdx"))
+            if acc is None:
+                return 404, "account not found"
+            if self.max_page is not None and int(query.get("count", 30)) > self.max_page:
+                return 400, "page size too large"
+            return 200, self.page(acc["numeroCompte"], query)
+
+        if u.path.endswith("n3.operations.encours.carte.debit.differe.json"):
+            acc = self.account(query.get("compteIdx"))
+            for card in self.cards:
+                if acc is not None and card["idCompte"] == self.sources[acc["numeroCompte"]] \
+                        and str(card["index"]) == query.get("carteIdx"):
+                    return 200, self.load("card_%s_operations.json" % card["idCarte"][-4:], default=[])
+            return 404, "card not found"
+
+        if u.path.endswith("ibaninformation.json"):
+            acc = self.account(query.get("compteIdx"))
+            if acc is None:
+                return 404, "account not found"
+            rsp = self.load("account_%s_iban.json" % self.sources[acc["numeroCompte"]], default={})
+            if "ibanData" not in rsp:
+                rsp = {"ibanData": {"ibanData": {"ibanCode": "FR7600000000%s00" % acc["numeroCompte"]}}}
+            return 200, rsp
+
+        if u.path.endswith("listeCartesParCompte.json"):
+            comptes = {}
+            for card in self.cards:
+                comptes.setdefault(card["idCompte"], []).append(card)
+            return 200, {"comptes": [{"idCompte": k, "listeCartes": v} for k, v in comptes.items()]}
+
+        if "npc.logout" in u.path:
+            return 200, ""
+
+        return 404, "no fixture for %s" % u.path
+
+    def page(self, numeroCompte, query):
+        """one page of operations, the cursor holds the offset and the end date"""
+        if "startIndex" in query:
+            offset, date_fin = query["startIndex"].split("|")
+            offset = int(offset)
+        else:
+            offset, date_fin = 0, query.get("dateFin", "")
+        date_debut = int(query.get("dateDebut", 0))
+        limit = int(query.get("count", 30))
+
+        window = (numeroCompte, date_debut, date_fin)
+        if window not in self.windows:
+            self.windows[window] = [op for ts, op in self.operations(numeroCompte)
+                                    if ts >= date_debut and (not date_fin or ts <= int(date_fin))]
+        ops = self.windows[window]
+        page = ops[offset:offset + limit]
+        rsp = {"listeOperations": page, "hasNext": offset + limit < len(ops)}
+        if rsp["hasNext"]:
+            rsp["nextSetStartIndex"] = "%s|%s" % (offset + limit, date_fin)
+        return rsp
+
+    def close(self):
+        """nothing to release"""
+        pass